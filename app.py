@@ -1,18 +1,29 @@
 VERSION="1.2.5"
-import requests, os, secrets, uuid, time, json, asyncio
+import time
+IMPORT_STARTED = time.perf_counter()  # Import-to-first-response timing, reported by /ready
+import requests, os, secrets, uuid, threading
 import logging
 from flask import Flask, request
 from flask_cors import CORS
-from langchain_huggingface import HuggingFaceEmbeddings
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams
-from qdrant_client.http.models import Filter, FieldCondition, MatchValue, PayloadSchemaType
+from pymongo import ReturnDocument
 from pymongo.mongo_client import MongoClient
 from dotenv import load_dotenv
-from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, Future
+from collections import deque
 
-from functions import gemini
+from graph_api import graph, GRAPH_API_URL
+from job_queue import PENDING, RUNNING, JobQueue, JobWorker, QueueFull
+from mongo_schema import ensure_message_indexes
+from pending_reels import PendingReels
+from search_sessions import SearchSessions
+from cache import TTLCache, CaptionCache, CacheGenerations, SharedStats, normalize_query, media_cache_key
+from embeddings import BatchEmbedder, ProcessPoolBackend, create_backend
+from lazy import LazyResource, warm_up_in_background
+from hybrid import SPARSE_VECTOR_NAME, CrossEncoderReranker, bm25_document_vector
+from vector_config import VectorConfig
+from vector_store import CollectionCache, TENANT_FIELD, find_point_by_mid, point_id, payload_source_id, search_points, tenant_filter
 from flask import render_template
 
 # Configure logging
@@ -29,25 +40,73 @@ logger.info(f"Launching version {VERSION}")
 
 load_dotenv(override=True)
 
+# Process role: "all" serves the web app and runs background jobs in one process (default),
+# "web" only serves HTTP and never loads the embedding model, "worker" only runs jobs.
+# See web.py and worker.py.
+APP_ROLE = os.environ.get("APP_ROLE", "all").lower()
+RUNS_WEB = APP_ROLE in ("all", "web")
+RUNS_JOBS = APP_ROLE in ("all", "worker")
+logger.info(f"Running as role '{APP_ROLE}'")
+
 # DB Connection
 db_connection_string = os.getenv("DB_CONNECTION_STRING")
 if db_connection_string is None or db_connection_string == "":
     logger.error("Please set the 'DB_CONNECTION_STRING' environment variable.")
     exit(1)
 
+# MongoClient connects in the background; collection handles below don't touch the server.
+# Creating collections and indexes happens in bootstrap_mongo (warm-up or first readiness check).
 client = MongoClient(str(db_connection_string))
 users = client["master"]["users"]
-if "users" not in client["master"].list_collection_names():
-    client["master"].create_collection(name="users", capped=False, autoIndexId=True)
-    logger.info(f"Created collection users.")
 processed = client["master"]["processed_mids"]
-if "processed_mids" not in client["master"].list_collection_names():
-    client["master"].create_collection(name="processed_mids", capped=False)
-    logger.info(f"Created collection processed_mids.")
 creds = client["master"]["creds"]
-if "creds" not in client["master"].list_collection_names():
-    client["master"].create_collection(name="creds", capped=False, autoIndexId=True)
-    logger.info(f"Created collection creds.")
+imports = client["master"]["imports"]
+caption_cache = CaptionCache(client["master"]["captions"], ttl=int(os.environ.get("CAPTION_CACHE_TTL", 30 * 24 * 60 * 60)))
+# Search-cache invalidation and cache counters shared by the web and worker processes
+search_generations = CacheGenerations(client["master"]["cache_generations"])
+shared_stats = SharedStats(client["master"]["cache_stats"], interval=int(os.environ.get("CACHE_STATS_INTERVAL", 30)))
+job_queue = JobQueue(
+    client["master"]["jobs"],
+    visibility_timeout=int(os.environ.get("JOB_VISIBILITY_TIMEOUT", 600)),
+    max_attempts=int(os.environ.get("JOB_MAX_ATTEMPTS", 5)),
+    max_pending=int(os.environ.get("JOB_MAX_PENDING", 1000))
+)
+
+# Instagram redelivers unacknowledged webhooks for up to ~36 hours; keep processed MIDs a bit longer
+PROCESSED_MID_TTL = int(os.environ.get("PROCESSED_MID_TTL", 2 * 24 * 60 * 60))
+# A reel waits this long in `users` for its description
+PENDING_REEL_TTL = int(os.environ.get("PENDING_REEL_TTL", 60 * 60))
+
+pending_reels = PendingReels(users)
+search_sessions = SearchSessions(client["master"]["search_sessions"], ttl=int(os.environ.get("SEARCH_SESSION_TTL", 30 * 60)))
+NO_PENDING_REEL_MESSAGE = "If you want to search for a similar reel, please use the command `search <your query>`"
+# A description can arrive just before its reel; the job waits this long before claiming again
+DESCRIPTION_RETRY_DELAY = float(os.environ.get("DESCRIPTION_RETRY_DELAY", 5))
+
+def bootstrap_mongo():
+    """Create the master collections and indexes (unique MIDs/senders, TTLs) if missing."""
+    existing = client["master"].list_collection_names()
+    for name in ("users", "processed_mids", "creds"):
+        if name not in existing:
+            client["master"].create_collection(name=name, capped=False)
+            logger.info(f"Created collection {name}.")
+    imports.create_index("conversation_id", unique=True)
+    ensure_message_indexes(processed, users, processed_ttl=PROCESSED_MID_TTL, pending_ttl=PENDING_REEL_TTL)
+    search_sessions.ensure_indexes()
+    caption_cache.ensure_indexes()
+    shared_stats.ensure_indexes()
+    job_queue.ensure_indexes()
+    return client
+
+mongo = LazyResource("mongo", bootstrap_mongo)
+
+def wait_for_mongo(retry_interval=5):
+    """Block until bootstrap_mongo has succeeded, retrying every `retry_interval` seconds."""
+    while True:
+        try:
+            return mongo.get()
+        except Exception:
+            time.sleep(retry_interval)
 
 # Fask config
 app = Flask(__name__)
@@ -56,12 +115,101 @@ CORS(app=app)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", secrets.token_hex(16))  # Use env variable if available
 app.config['DEBUG'] = os.environ.get("FLASK_DEBUG", "False").lower() == "true"
 
-qdrant_client = QdrantClient(url=os.environ.get("QDRANT_URL"), api_key=os.environ.get("QDRANT_API_KEY"))
-EMBEDDING_MODEL = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-# EMBEDDING_MODEL = None
-logger.info(f"Finished Loading Embedding Model")
-executor = ThreadPoolExecutor(max_workers=10)
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", 32))
+
+def load_embedding_service():
+    if not RUNS_JOBS:
+        # Web-only process: all embedding happens in worker processes
+        raise RuntimeError(f"Embedding model is not available in role '{APP_ROLE}'")
+    # EMBEDDING_BACKEND selects huggingface (default), onnx or onnx-int8.
+    # EMBEDDING_PROCESSES > 0 runs that backend in a pool of processes to use more cores.
+    processes = int(os.environ.get("EMBEDDING_PROCESSES", 0))
+    if processes > 0:
+        backend = ProcessPoolBackend(os.environ.get("EMBEDDING_BACKEND", "huggingface"), processes=processes, batch_size=EMBEDDING_BATCH_SIZE)
+    else:
+        backend = create_backend(batch_size=EMBEDDING_BATCH_SIZE)
+    logger.info(f"Using embedding backend '{backend.name}'")
+    return BatchEmbedder(
+        backend,
+        batch_size=EMBEDDING_BATCH_SIZE,
+        max_wait_ms=int(os.environ.get("EMBEDDING_BATCH_WAIT_MS", 10)),
+        workers=max(1, processes)
+    )
+
+# Heavy clients are created on first use (or by the background warm-up), not at import
+qdrant = LazyResource("qdrant", lambda: QdrantClient(url=os.environ.get("QDRANT_URL"), api_key=os.environ.get("QDRANT_API_KEY")))
+embedding_service = LazyResource("embedding_model", load_embedding_service)
+
+def load_gemini_worker():
+    # Imported on first use: importing functions starts the Gemini loop thread (and pulls in
+    # google-genai), which web-only processes never need
+    from functions import gemini_worker, scratch_space
+    gemini_worker.caption_cache = caption_cache
+    scratch_space.sweep()
+    return gemini_worker
+
+gemini = LazyResource("gemini", load_gemini_worker)
+
+def get_qdrant_client():
+    return qdrant.get()
+
+def get_embedding_service():
+    return embedding_service.get()
+
+# Storage layout: "per-user" keeps one collection per sender_id (default); "shared" stores
+# everyone in QDRANT_SHARED_COLLECTION, partitioned by a sender_id tenant index.
+# Move existing data with `python manage.py migrate-shared`.
+QDRANT_LAYOUT = os.environ.get("QDRANT_LAYOUT", "per-user").lower()
+SHARED_COLLECTION = os.environ.get("QDRANT_SHARED_COLLECTION", "reels")
+SHARED_LAYOUT = QDRANT_LAYOUT == "shared"
+
+# Search mode: "dense" (MiniLM only, default) or "hybrid", which also stores a BM25 sparse
+# vector per point and fuses both rankings (reciprocal rank fusion) so exact words like a
+# creator name or a quote are found. Existing collections need `manage.py enable-hybrid`.
+# RERANKER_MODEL (e.g. cross-encoder/ms-marco-MiniLM-L-6-v2) re-scores the top
+# SEARCH_CANDIDATES with a CPU cross-encoder; empty disables reranking.
+SEARCH_MODE = os.environ.get("SEARCH_MODE", "dense").lower()
+HYBRID_SEARCH = SEARCH_MODE == "hybrid"
+SEARCH_CANDIDATES = int(os.environ.get("SEARCH_CANDIDATES", 20))
+RERANKER_MODEL = os.environ.get("RERANKER_MODEL", "")
+reranker = LazyResource("reranker", lambda: CrossEncoderReranker(RERANKER_MODEL))
+# `search <query>` keeps up to SEARCH_TOP_K distinct reels scoring at least SEARCH_SCORE_THRESHOLD
+# (cosine, or cross-encoder score when reranking; RRF fusion scores are rank-based, so the
+# threshold doesn't apply to hybrid results without a reranker). `next` walks that list.
+SEARCH_TOP_K = int(os.environ.get("SEARCH_TOP_K", 5))
+SEARCH_SCORE_THRESHOLD = float(os.environ.get("SEARCH_SCORE_THRESHOLD", 0))
+# Quantization, on-disk storage and HNSW settings for new collections and the matching
+# query-time rescoring (QDRANT_QUANTIZATION, QDRANT_ON_DISK_*, QDRANT_HNSW_*, QDRANT_RESCORE,
+# QDRANT_OVERSAMPLING; see vector_config.py). `manage.py apply-vector-config` updates existing ones.
+vector_config = VectorConfig.from_env()
+SEARCH_PARAMS = vector_config.search_params()
+logger.info(f"Vector config: {vector_config.describe()}")
+known_collections = CollectionCache(shared_collection=SHARED_COLLECTION, hybrid=HYBRID_SEARCH, config=vector_config)
+
+def collection_for(sender_id):
+    """Qdrant collection holding a user's points."""
+    return SHARED_COLLECTION if SHARED_LAYOUT else sender_id
+
+# Search caches: query text -> embedding, and (collection, query) -> ranked points
+SEARCH_CACHE_SIZE = int(os.environ.get("SEARCH_CACHE_SIZE", 1024))
+SEARCH_CACHE_TTL = int(os.environ.get("SEARCH_CACHE_TTL", 600))
+query_embedding_cache = TTLCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+search_result_cache = TTLCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+executor = ThreadPoolExecutor(max_workers=int(os.environ.get("EXECUTOR_WORKERS", 10)))
 logger.info(f"Finished Executor")
+# Warm up mongo/qdrant/model on a background thread at startup; otherwise they load on first use
+WARMUP_ON_START = os.environ.get("WARMUP_ON_START", "True").lower() == "true"
+startup_stats = {"import_seconds": None, "first_response_seconds": None}
+
+# Fast-ack webhook ingestion: POSTs are validated and persisted as `event` jobs before the 200,
+# so an acknowledged event survives a crash; dispatcher workers in web processes do the DB/Graph API work
+WEBHOOK_FAST_ACK = os.environ.get("WEBHOOK_FAST_ACK", "True").lower() == "true"
+WEBHOOK_DISPATCHERS = int(os.environ.get("WEBHOOK_DISPATCHERS", 4))
+dispatch_executor = ThreadPoolExecutor(max_workers=WEBHOOK_DISPATCHERS)
+ack_latencies = deque(maxlen=int(os.environ.get("WEBHOOK_LATENCY_SAMPLES", 1000)))
+ack_latency_lock = threading.Lock()
+# Messaging events from one (possibly batched) payload are processed on this pool, one task per sender
+event_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("WEBHOOK_EVENT_WORKERS", 10)))
 
 @app.route('/webhook', methods=['GET', 'POST'])
 def webhook():
@@ -76,6 +224,7 @@ def webhook():
             return 'Invalid verify_token', 403
 
         elif request.method == 'POST':
+            started = time.perf_counter()
             body = request.get_json()
             logger.info(f"POST request received with body: {body}")
             
@@ -83,169 +232,147 @@ def webhook():
             if not body.get('object') == 'instagram':
                 return 'Invalid object type', 400
                 
+            if not WEBHOOK_FAST_ACK:
+                result = process_webhook(body)
+                record_ack_latency(time.perf_counter() - started)
+                return result
+
+            # Fast-ack: persist the raw event for the dispatchers and return immediately
             try:
-                messaging = body['entry'][0]['messaging'][0]
-                sender_id = messaging['sender']['id']                    
-                mid = messaging['message']['mid']
-                created_time = body['entry'][0].get('time')
-                message = messaging.get('message', {})
-
-                # Skip messages from ourselves
-                if sender_id == os.environ.get('IG_ID'):
-                    return 'EVENT_RECEIVED', 200
+                # Keyed by sender so one sender's webhooks are processed in the order they arrived.
+                # Event keys are namespaced so a search job in retry backoff never holds up events.
+                job_queue.enqueue("event", {"body": body}, order_keys=[f"event:{sender}" for sender in event_senders(body)])
+            except QueueFull as exc:
+                logger.error(f"Webhook queue full, asking Instagram to redeliver later: {exc}")
+                return 'Busy', 503
+            record_ack_latency(time.perf_counter() - started)
+            return 'EVENT_RECEIVED', 200
+                
+        return 'Method not allowed', 405
+        
+    except Exception as exc:
+        logger.exception("Webhook error: %s", exc)
+        return 'Internal error', 500
 
-                # Check for duplicate/already processed message
-                if processed.find_one({"mid": mid}):
-                    logger.info(f"Skipping already processed message {mid}")
-                    return 'EVENT_RECEIVED', 200
+def event_senders(body):
+    """Distinct sender ids of the messaging events in a webhook payload (empty if malformed)."""
+    try:
+        senders = [messaging['sender']['id'] for entry in body['entry'] for messaging in entry.get('messaging', [])]
+    except (KeyError, TypeError, AttributeError):
+        return []
+    return sorted(set(senders))
+
+def process_webhook(body):
+    """
+    Fan out a validated Instagram webhook payload. Every messaging event in every entry is
+    deduplicated by MID (within the batch and against `processed` in one query). The remaining
+    events are grouped by sender: each sender's events are processed in order (a reel before
+    its description, `search` before `next`), different senders in parallel.
+    Returns (text, status) of the first failure, if any.
+    """
+    try:
+        events = [(messaging, entry.get('time')) for entry in body['entry'] for messaging in entry.get('messaging', [])]
+    except (KeyError, TypeError, AttributeError) as e:
+        logger.error(f"Malformed webhook payload: {e}")
+        return 'Malformed payload', 400
+    if not events:
+        logger.error("Malformed webhook payload: no messaging events")
+        return 'Malformed payload', 400
+
+    mids = [messaging.get('message', {}).get('mid') for messaging, _ in events]
+    known = {doc["mid"] for doc in processed.find({"mid": {"$in": [mid for mid in mids if mid]}}, {"mid": 1})}
+    pending = []
+    for (messaging, created_time), mid in zip(events, mids):
+        if mid and mid in known:
+            logger.info(f"Skipping already processed message {mid}")
+            continue
+        if mid:
+            known.add(mid)
+        pending.append((messaging, created_time))
+
+    by_sender = {}
+    for messaging, created_time in pending:
+        sender_id = (messaging.get('sender') or {}).get('id')
+        by_sender.setdefault(sender_id, []).append((messaging, created_time))
+    futures = [event_executor.submit(process_events_in_order, sender_events) for sender_events in by_sender.values()]
+    failures = [result for future in futures for result in future.result() if result[1] != 200]
+    if len(events) > 1:
+        logger.info(f"Processed webhook batch: {len(events)} events, {len(pending)} new, {len(failures)} failed")
+    return failures[0] if failures else ('EVENT_RECEIVED', 200)
+
+def process_events_in_order(events):
+    """Process one sender's (messaging, created_time) events one after another. Returns their results."""
+    return [process_event(messaging, created_time) for messaging, created_time in events]
+
+def process_event(messaging, created_time):
+    """Process a single messaging event: route to the right handler and reply. Returns (text, status)."""
+    try:
+        sender_id = messaging['sender']['id']                    
+        mid = messaging['message']['mid']
+        message = messaging.get('message', {})
+
+        # Skip messages from ourselves
+        if sender_id == os.environ.get('IG_ID'):
+            return 'EVENT_RECEIVED', 200
+
+        # Handle text messages
+        if text := message.get('text'):
+            text = text.lower()
+            if text.strip() == "next":
+                enqueue_job("next", order_key=f"search:{sender_id}", sender_id=sender_id, mid=mid)
+                return 'EVENT_RECEIVED', 200
+
+            if text.startswith("search"):
+                search_query = text.split("search", 1)[1].strip()
+                enqueue_job("search", order_key=f"search:{sender_id}", sender_id=sender_id, search_query=search_query, mid=mid)
+                return 'EVENT_RECEIVED', 200
+            
+            if message.get('reply_to'):
+                # Add this text as extra context for the replied-to reel
+                enqueue_job("reply", sender_id=sender_id, text=text, mid=mid, replied_to_mid=message.get('reply_to').get('mid'), created_time=created_time)
+                return 'EVENT_RECEIVED', 200
                 
-                # Handle text messages
-                if text := message.get('text'):
-                    text = text.lower()
-                    if text.startswith("search"):
-                        search_query = text.split("search", 1)[1].strip()
-                        executor.submit(handle_search, sender_id, search_query, mid)
-                        return 'EVENT_RECEIVED', 200
-                    
-                    if message.get('reply_to'):
-                        # PROCESS THIS by SEARCHING IN QDRANT USING MID AS A METADATA
-                        replied_to_mid = message.get('reply_to').get('mid')
-                        logger.info(f"Looking for replied-to MID: {replied_to_mid[:50]}...")
-                        logger.debug(f"Full replied-to MID: {replied_to_mid}")
-                        logger.debug(f"Current message MID: {mid}")
-                        
-                        try:
-                            # Find the point by MID without requiring an index
-                            def find_point_by_mid(collection_name, target_mid):
-                                """Find a point in Qdrant by MID without requiring an index. Manually iterates through all points."""
-                                try:
-                                    logger.info(f"Searching for MID {target_mid[:50]}... in collection {collection_name}")
-                                    
-                                    # Scroll through all points in the collection
-                                    offset = 0
-                                    all_mids = []  # Track all MIDs for debugging
-                                    while True:
-                                        points, next_offset = qdrant_client.scroll(
-                                            collection_name=collection_name,
-                                            offset=offset,
-                                            limit=100,  # Fetch 100 at a time
-                                            with_payload=True,
-                                            with_vectors=False
-                                        )
-                                        
-                                        logger.debug(f"Scrolled batch: {len(points)} points, next_offset: {next_offset}")
-                                        
-                                        # Check each point for matching MID
-                                        for point in points:
-                                            point_mid = point.payload.get("mid")
-                                            all_mids.append(point_mid)
-                                            
-                                            if point_mid == target_mid:
-                                                logger.info(f"Found matching point for MID: {target_mid[:50]}...")
-                                                return point
-                                        
-                                        # If no more points, break
-                                        if next_offset is None or len(points) == 0:
-                                            break
-                                        
-                                        offset = next_offset
-                                    
-                                    logger.warning(f"No point found with MID: {target_mid[:50]}...")
-                                    logger.info(f"Available MIDs in collection ({len(all_mids)} total):")
-                                    for mid in all_mids[:10]:  # Show first 10
-                                        logger.info(f"  - {mid[:50]}... (full: {mid})")
-                                    return None
-                                    
-                                except Exception as e:
-                                    logger.exception(f"Error finding point by MID: {e}")
-                                    return None
-
-                            found_point = find_point_by_mid(sender_id, replied_to_mid)
-                            
-                            if not found_point:
-                                logger.warning(f"No points found for replied-to MID: {replied_to_mid}")
-                                send_error_message(sender_id, "Cannot add context to the message you replied to. Reel Not Found using reply_to.")
-                                return 'EVENT_RECEIVED', 200
-                            
-                            # Extract payload from the found point
-                            found_payload = found_point.payload
-                            logger.info(f"Found point with payload: {found_payload}")
-                            
-                            store_embeddings(sender_id, [{
-                                "sender_id": sender_id,
-                                "message": text,
-                                "mid": mid,
-                                "reel_id": found_payload.get("reel_id"),
-                                "link": found_payload.get("link"),
-                                "created_time": created_time
-                            }])
-                            return 'EVENT_RECEIVED', 200
-                            
-                        except Exception as e:
-                            logger.exception(f"Error searching for replied-to MID {replied_to_mid}: {e}")
-                            send_error_message(sender_id, f"Error processing reply: {str(e)}")
-                            return 'EVENT_RECEIVED', 200
-                        
-                    # Handle description for previous reel
-                    user = users.find_one({"sender_id": sender_id})
-                    if not user:
-                        # THIS COULD BE THE ISSUE FOR SERVER KEEP GETTING WEBHOOK REQUEST FROM INSTA
-                        time.sleep(5)  # Brief retry
-                        user = users.find_one({"sender_id": sender_id})
-                        if not user:
-                            send_error_message(sender_id, "If you want to search for a similar reel, please use the command `search <your query>`")
-                            return 'EVENT_RECEIVED', 200
-                        
-                    current_time = int(datetime.now().timestamp() * 1000)
-                    if current_time - user.get("created_time", 0) > 1000 * 60 * 60:
-                        send_error_message(sender_id, "Too late to process your last reel. Please try to send the reel again with your message within 1hr.")
-                        send_error_message(sender_id, "If you want to search for a similar reel, please use the command `search <your query>`")
-                        users.delete_one({"sender_id": sender_id})
+            # Handle description for previous reel.
+            # Reels older than PENDING_REEL_TTL are removed by the TTL index on users.created_at.
+            # The job claims whichever reel is pending when it runs (and waits briefly for one).
+            enqueue_job("description", sender_id=sender_id, text=text, mid=mid)
+            return 'EVENT_RECEIVED', 200
+        
+        # Handle attachments (reels)
+        if attachments := message.get('attachments'):
+            for attachment in attachments:
+                attachement_type = attachment.get('type')
+                url = attachment['payload'].get('url', '')
+                if attachement_type in ['ig_reel', 'ig_post']:
+                    context = {
+                        "sender_id": sender_id,
+                        "mid": mid,
+                        "reel_id": attachment['payload'].get('reel_video_id', None),
+                        "post_id": attachment['payload'].get('ig_post_media_id', None),
+                        "created_time": created_time,
+                        "url": url
+                    }
+                    if not enqueue_job("attachment", context=context):
                         return 'EVENT_RECEIVED', 200
-                        
-                    executor.submit(handle_reel_description, sender_id, user, text, mid)
-                    return 'EVENT_RECEIVED', 200
-                
-                # Handle attachments (reels)
-                if attachments := message.get('attachments'):
-                    for attachment in attachments:
-                        attachement_type = attachment.get('type')
-                        url = attachment['payload'].get('url', '')
-                        if attachement_type in ['ig_reel', 'ig_post']:
-                            context = {
-                                "sender_id": sender_id,
-                                "mid": mid,
-                                "reel_id": attachment['payload'].get('reel_video_id', None),
-                                "post_id": attachment['payload'].get('ig_post_media_id', None),
-                                "created_time": created_time,
-                                "url": url
-                            }
-                            executor.submit(handle_attachment, context)
-                            send_reaction(sender_id, mid, "love")
-                            users.delete_many({"sender_id": sender_id})
-                            users.insert_one({
-                                "sender_id": sender_id,
-                                "message": attachment['payload'].get('title', ''),
-                                "mid": mid,
-                                "reel_id": attachment['payload'].get('reel_video_id'),
-                                "link": url,
-                                "created_time": created_time
-                            })
-                            return 'EVENT_RECEIVED', 200
-                    send_error_message(sender_id, "Unsupported attachment type. Please send an Instagram reel.")
+                    send_reaction(sender_id, mid, "love")
+                    pending_reels.put(sender_id, {
+                        "message": attachment['payload'].get('title', ''),
+                        "mid": mid,
+                        "reel_id": attachment['payload'].get('reel_video_id'),
+                        "link": url
+                    }, created_time=created_time)
                     return 'EVENT_RECEIVED', 200
-                # Unhandled message type
-                
-                logger.warning(f"Unhandled message type for mid {mid}")
-                send_error_message(sender_id, f"Unhandled message type.")
-                return 'EVENT_RECEIVED', 200
-                
-            except (KeyError, IndexError) as e:
-                logger.error(f"Malformed webhook payload: {e}")
-                return 'Malformed payload', 400
-                
-        return 'Method not allowed', 405
+            send_error_message(sender_id, "Unsupported attachment type. Please send an Instagram reel.")
+            return 'EVENT_RECEIVED', 200
+        # Unhandled message type
+        
+        logger.warning(f"Unhandled message type for mid {mid}")
+        send_error_message(sender_id, f"Unhandled message type.")
+        return 'EVENT_RECEIVED', 200
         
+    except (KeyError, IndexError) as e:
+        logger.error(f"Malformed webhook payload: {e}")
+        return 'Malformed payload', 400
     except Exception as exc:
         logger.exception("Webhook error: %s", exc)
         try:
@@ -255,195 +382,386 @@ def webhook():
             pass
         return 'Internal error', 500
 
+def handle_event(body):
+    """
+    Background worker: process a webhook payload persisted by the fast-ack webhook.
+    Per-event failures are logged (the user has been told); errors before any event was
+    routed, e.g. Mongo being unavailable, propagate so the event is retried.
+    """
+    result = process_webhook(body)
+    if result[1] != 200:
+        logger.warning(f"Webhook event not processed: {result}")
+
+def start_event_workers():
+    """Start the dispatchers for persisted webhook events once Mongo is bootstrapped."""
+    wait_for_mongo()
+    return JobWorker(
+        job_queue, "event", handle_event, dispatch_executor, concurrency=WEBHOOK_DISPATCHERS,
+        poll_interval=float(os.environ.get("WEBHOOK_POLL_INTERVAL", 0.1))
+    ).start()
+
+def record_ack_latency(seconds):
+    with ack_latency_lock:
+        ack_latencies.append(seconds)
+
+def ack_latency_stats():
+    """Percentiles (in milliseconds) over the last WEBHOOK_LATENCY_SAMPLES webhook acks."""
+    with ack_latency_lock:
+        samples = sorted(ack_latencies)
+    if not samples:
+        return {"count": 0}
+    percentile = lambda p: round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 3)
+    return {"count": len(samples), "p50_ms": percentile(0.50), "p99_ms": percentile(0.99), "max_ms": round(samples[-1] * 1000, 3)}
+
+def enqueue_job(job_type, order_key=None, **payload):
+    """
+    Persist a background job and return its id. Returns None (and tells the user) when the queue is applying backpressure.
+    Jobs with the same `order_key` (search and next, keyed `search:<sender_id>`) run in the order they were queued.
+    """
+    try:
+        return job_queue.enqueue(job_type, payload, order_keys=[order_key] if order_key else None)
+    except QueueFull as exc:
+        logger.error(f"Rejecting {job_type} job: {exc}")
+        sender_id = payload.get("sender_id") or payload.get("context", {}).get("sender_id")
+        if sender_id:
+            send_error_message(sender_id, "We're busy right now, please try again in a few minutes.")
+        return None
+
+def mark_processed(mid, **fields):
+    """Record a handled MID. Upserts, since `mid` is unique and a retry may record it twice."""
+    processed.update_one(
+        {"mid": mid},
+        {"$set": {**fields, "timestamp": int(datetime.now().timestamp() * 1000), "processed_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+
+def handle_reply_context(sender_id, text, mid, replied_to_mid, created_time):
+    """Background worker: store a reply as extra context for the reel it replies to."""
+    # Look up the replied-to reel in Qdrant using the indexed MID payload
+    logger.info(f"Looking for replied-to MID: {replied_to_mid[:50]}...")
+    logger.debug(f"Full replied-to MID: {replied_to_mid}")
+    logger.debug(f"Current message MID: {mid}")
+    # Other errors propagate so the job is retried; the user hears about it once it is dead-lettered
+    found_point = find_point_by_mid(get_qdrant_client(), collection_for(sender_id), replied_to_mid, sender_id=sender_id if SHARED_LAYOUT else None)
+    
+    if not found_point:
+        logger.warning(f"No points found for replied-to MID: {replied_to_mid}")
+        send_error_message(sender_id, "Cannot add context to the message you replied to. Reel Not Found using reply_to.")
+        return
+    
+    # Extract payload from the found point
+    found_payload = found_point.payload
+    logger.info(f"Found point with payload: {found_payload}")
+    
+    response = store_embeddings(sender_id, [{
+        "sender_id": sender_id,
+        "message": text,
+        "mid": mid,
+        "reel_id": found_payload.get("reel_id"),
+        "link": found_payload.get("link"),
+        "created_time": created_time
+    }])
+    if response.get("error"):
+        raise RuntimeError(response["error"])
+
 def handle_search(sender_id, search_query, mid):
     """Background worker: Process search request and send similar reel."""
-    try:
-        response = send_similar_reel(sender_id, search_query)
-        # response can be a dict with error info or a requests.Response on success
-        if isinstance(response, dict) and response.get('error'):
-            logger.error(f"Search error for mid {mid}: {response.get('error')}")
-            send_error_message(sender_id, "Error finding similar reel")
-            return
+    # A retry after the reel went out must not send it again
+    if processed.find_one({"mid": mid}):
+        logger.info(f"Skipping already processed search mid: {mid}")
+        return
+    # Qdrant/Graph API errors before the reel is sent propagate so the job is retried
+    response = send_similar_reel(sender_id, search_query, mid=mid)
+    # response is a dict when there was nothing to send (the user has been told) or a requests.Response on success
+    if isinstance(response, dict) and response.get('error'):
+        logger.info(f"Search for mid {mid} sent nothing: {response.get('error')}")
+        return
 
-        if isinstance(response, requests.Response):
-            # Try to parse JSON error if present
-            try:
-                json_resp = response.json()
-                if isinstance(json_resp, dict) and json_resp.get('error'):
-                    logger.error(f"Search error for mid {mid}: {json_resp.get('error')}")
-                    send_error_message(sender_id, "Error finding similar reel")
-                    return
-            except ValueError:
-                # Non-JSON response: treat non-2xx as error
-                if not (200 <= response.status_code < 300):
-                    logger.error(f"Search failed for mid {mid}: HTTP {response.status_code}")
-                    send_error_message(sender_id, "Error finding similar reel")
-                    return
-        elif not isinstance(response, dict):
-            # Unknown response type
-            logger.error(f"Unexpected response type for mid {mid}: {type(response)}")
-            send_error_message(sender_id, "Error finding similar reel")
-            return
+    logger.info(f"Search response for mid {mid}: {response}")
+    react_after_send(sender_id, mid)
 
-        logger.info(f"Search response for mid {mid}: {response}")
-        processed.insert_one({"mid": mid, "type": "search", "timestamp": int(datetime.now().timestamp() * 1000)})
+def react_after_send(sender_id, mid):
+    """React to a handled message. Logs instead of raising: the reply is already out, a retry would resend it."""
+    try:
         send_reaction(sender_id, mid, "love")
     except Exception as exc:
-        logger.exception(f"Error in handle_search for mid {mid}: {exc}")
-        send_error_message(sender_id, "Error processing search")
+        logger.warning(f"Could not react to mid {mid}: {exc}")
+
+def handle_next(sender_id, mid):
+    """Background worker: send the next cached result of the sender's last search."""
+    # A retry after the reel went out must not send it again
+    if processed.find_one({"mid": mid}):
+        logger.info(f"Skipping already processed next mid: {mid}")
+        return
+    response = send_next_reel(sender_id, mid)
+    if isinstance(response, requests.Response):
+        react_after_send(sender_id, mid)
 
-def handle_reel_description(sender_id, user, text, mid):
+def handle_reel_description(sender_id, text, mid, user=None):
     """Background worker: Process text description for previously sent reel."""
+    # `user` is only present in jobs queued before pending reels were claimed atomically
     try:
-        user["message"] = text
-        id = user.pop("_id", None)
-        response = store_embeddings(sender_id, [user])
-        if response.get("error"):
-            logger.error(f"Error storing embeddings for mid {mid}: {response.get('error')}")
-            send_error_message(sender_id, "Error storing your description")
+        reel = pending_reels.claim(sender_id, mid)
+        if not reel:
+            # The reel may still be on its way; runs on a job worker, so this doesn't hold up webhooks
+            time.sleep(DESCRIPTION_RETRY_DELAY)
+            reel = pending_reels.claim(sender_id, mid)
+        if not reel:
+            # Never sent, expired, or another description got there first
+            logger.info(f"No pending reel to describe for mid {mid}")
+            send_error_message(sender_id, NO_PENDING_REEL_MESSAGE)
             return
-            
-        users.delete_one({"_id": id})
-        processed.insert_one({"mid": mid, "type": "description", "timestamp": int(datetime.now().timestamp() * 1000)})
-        send_reaction(sender_id, mid, "love")
-    except Exception as exc:
-        logger.exception(f"Error in handle_reel_description for mid {mid}: {exc}")
-        send_error_message(sender_id, "Error processing your description")
+
+        payload = {key: value for key, value in reel.items() if key not in ("_id", "created_at", "claimed_by")}
+        payload["message"] = text
+        # The payload keeps the reel's mid; the point is keyed by the description message
+        response = store_embeddings(sender_id, [payload], source_ids=[mid])
+        if response.get("error"):
+            raise RuntimeError(response["error"])
+    except Exception:
+        # Hand the reel back so the retried job can claim it again
+        pending_reels.release(sender_id, mid)
+        raise
+
+    pending_reels.complete(sender_id, mid)
+    mark_processed(mid, type="description")
+    send_reaction(sender_id, mid, "love")
 
 def handle_attachment(context):
-    """Background worker: run Gemini, store embeddings, send messages/reactions and mark mid processed."""
+    """Background worker: hand the reel to the Gemini pipeline without waiting for the caption."""
     sender_id = context.get("sender_id")
     mid = context.get("mid")
     url = context.get("url")
     reel_id = context.get("reel_id")
     post_id = context.get("post_id")
-    created_time = context.get("created_time")
-    try:
-        # idempotency: skip if this mid already processed
-        if processed.find_one({"mid": mid}):
-            logger.info(f"Skipping already processed mid: {mid}")
-            return
+    # idempotency: skip if this mid already processed
+    if processed.find_one({"mid": mid}):
+        logger.info(f"Skipping already processed mid: {mid}")
+        return
 
-        title = run_gemini(url, True if reel_id else False)
-        
-        if title == "Gemini API quota exceeded":
-            logger.error("Gemini API quota exceeded for URL: %s", url)
-            send_error_message(sender_id, "Gemini API quota exceeded, try again later")
-            # mark as failed_quota to avoid immediate reprocessing
-            processed.insert_one({"mid": mid, "status": "failed_quota", "timestamp": int(datetime.now().timestamp() * 1000)})
-            return
-        if title == "Error running Gemini":
-            logger.error("Error running Gemini for URL: %s", url)
-            send_error_message(sender_id, "Error processing your reel, try again later")
-            return
+    # The executor thread is released here; finish_attachment runs once Gemini is done.
+    # Reels captioned before (for any user) are answered from the caption cache.
+    # The returned future keeps the job leased until the reel is fully stored, and fails
+    # it (retry with backoff, then dead-letter) if finish_attachment raises.
+    finished = Future()
+    def on_caption(caption_future):
+        try:
+            executor.submit(finish_attachment, context, gemini_result(caption_future)).add_done_callback(lambda f: chain_future(f, finished))
+        except Exception as exc:
+            finished.set_exception(exc)
+    gemini.get().submit(url, True if reel_id else False, media_key=media_cache_key(reel_id, post_id)).add_done_callback(on_caption)
+    return finished
 
-        payload = {
-            "sender_id": sender_id,
-            "message": title,
-            "mid": mid,
-            "reel_id": reel_id if reel_id else post_id,
-            "link": url,
-            "created_time": created_time
-        }
+def chain_future(source, target):
+    """Copy the outcome of a finished future onto another."""
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
 
-        response = store_embeddings(sender_id, [payload])
-        if response.get("error"):
-            logger.error("Error storing embeddings for mid %s: %s", mid, response.get("error"))
-            send_error_message(sender_id, "Error storing data, try again later")
-            return
-        
-        # mark processed
-        processed.insert_one({"mid": mid, "timestamp": int(datetime.now().timestamp() * 1000)})
+def finish_attachment(context, title):
+    """
+    Background worker: store embeddings for the Gemini caption, send messages/reactions and mark mid processed.
+    Raises on Gemini or storage errors so the attachment job is retried with backoff.
+    """
+    sender_id = context.get("sender_id")
+    mid = context.get("mid")
+    url = context.get("url")
+    reel_id = context.get("reel_id")
+    post_id = context.get("post_id")
+    created_time = context.get("created_time")
+    if title == "File too large":
+        # Retrying won't make it smaller
+        from functions import MAX_DOWNLOAD_BYTES
+        send_error_message(sender_id, f"This reel is too large to process (max {MAX_DOWNLOAD_BYTES // (1024 * 1024)} MB).")
+        mark_processed(mid, status="too_large")
+        return
+    if title in ("Gemini API quota exceeded", "Error running Gemini"):
+        logger.error("%s for URL: %s", title, url)
+        raise RuntimeError(title)
 
-        # notify user and react
-        send_error_message(sender_id, title)
-        send_reaction(sender_id, mid, "love")
-    except Exception as exc:
-        logger.exception("Exception in handle_attachment: %s", exc)
-        send_error_message(sender_id, "Internal error processing your reel")
+    payload = {
+        "sender_id": sender_id,
+        "message": title,
+        "mid": mid,
+        "reel_id": reel_id if reel_id else post_id,
+        "link": url,
+        "created_time": created_time
+    }
 
-def store_embeddings(collection_name, messages):
+    response = store_embeddings(sender_id, [payload])
+    if response.get("error"):
+        raise RuntimeError(response["error"])
+    
+    # mark processed
+    mark_processed(mid)
+
+    # notify user and react
+    send_error_message(sender_id, title)
+    send_reaction(sender_id, mid, "love")
+
+def store_embeddings(collection_name, messages, source_ids=None):
+    """
+    Embed and upsert `messages` (payload dicts) into a collection, creating it if needed.
+    Point IDs derive from `source_ids` (the message each text came from), defaulting to each
+    payload's `id`/`mid`, so a retried webhook or re-import overwrites instead of duplicating.
+    """
     try:
-        try:
-            qdrant_client.get_collection(collection_name)
-        except:
-            qdrant_client.create_collection(
-                collection_name=collection_name,
-                vectors_config=VectorParams(size=384, distance=Distance.COSINE)
-            )
-            logger.info(f"Created new collection: {collection_name}")
+        qdrant_client = get_qdrant_client()
+        target = collection_for(collection_name)
+        sparse = known_collections.ensure(qdrant_client, target)
+        if SHARED_LAYOUT:
+            messages = [{**message, TENANT_FIELD: collection_name} for message in messages]
     
+        vectors = get_embedding_service().embed_many([message.get("message") for message in messages])
+        source_ids = source_ids or [payload_source_id(message) for message in messages]
         embeddings_list = []
-        for message in messages:
-            embedding = EMBEDDING_MODEL.embed_query(message.get("message"))
+        for message, embedding, source_id in zip(messages, vectors, source_ids):
             embeddings_list.append({
-                "id": int(uuid.uuid4().int % (10**12)),  # Generate unique 12-digit ID
-                "vector": embedding,
+                "id": point_id(source_id) if source_id else str(uuid.uuid4()),
+                "vector": {"": embedding, SPARSE_VECTOR_NAME: bm25_document_vector(message.get("message"))} if sparse else embedding,
                 "payload": message
             })
         logger.info(f"Embeddings list: {embeddings_list}")
 
-        qdrant_client.upsert(
-            collection_name=collection_name,
-            points=embeddings_list
-        )
+        try:
+            qdrant_client.upsert(
+                collection_name=target,
+                points=embeddings_list
+            )
+        except Exception:
+            known_collections.forget(target)
+            raise
+        invalidate_search_cache(collection_name)
         return {"message": "Embeddings stored successfully"}
     except requests.RequestException as exc:
         logger.error(f"Error in store_embeddings: {exc}")
-        send_error_message(collection_name, str(exc))
         return {"error": f"Error storing embeddings: {exc}"}
 
+def invalidate_search_cache(collection_name):
+    """Drop cached search results for a collection after its points change, in every process."""
+    search_generations.bump(collection_name)
+    removed = search_result_cache.invalidate(lambda key: key[0] == collection_name)
+    if removed:
+        logger.debug(f"Invalidated {removed} cached searches for collection {collection_name}")
+
+def get_query_embedding(text):
+    """Embed a search query, reusing cached vectors for identical normalized text."""
+    key = normalize_query(text)
+    embedding = query_embedding_cache.get(key)
+    if embedding is None:
+        embedding = get_embedding_service().embed(key)
+        query_embedding_cache.set(key, embedding)
+    return embedding
+
 def get_similar_messages(collection_name, text):
-    try:
-        embedding = EMBEDDING_MODEL.embed_query(text)
-        response = qdrant_client.query_points(
-            collection_name=collection_name,
-            query=embedding,
-            limit=1
-        )
-        return response.points
-    except requests.RequestException as exc:
-        logger.error(f"Error in get_similar_messages: {exc}")
-        send_error_message(collection_name, str(exc))
-        return {"error": f"Error retrieving similar messages: {exc}"}
+    """Ranked points for a search query, best first, above SEARCH_SCORE_THRESHOLD."""
+    # The generation changes when any process stores points, so stale results are never hit
+    cache_key = (collection_name, search_generations.get(collection_name), normalize_query(text))
+    points = search_result_cache.get(cache_key)
+    if points is not None:
+        logger.debug(f"Search cache hit for {cache_key}")
+        return points
 
-def send_similar_reel(sender_id, text):
-    try:
-        logger.info(f"Started send_similar_reel")
-        response = get_similar_messages(collection_name=sender_id, text=text)
-        if not response or not response[0].payload:
-            logger.info("No results found.")
-            send_error_message(sender_id, "No similar reels found. Try a different search query.")
-            return {"error": "No similar messages found."}
+    embedding = get_query_embedding(text)
+    qdrant_client = get_qdrant_client()
+    target = collection_for(collection_name)
+    hybrid = HYBRID_SEARCH and known_collections.has_sparse(qdrant_client, target)
+    points = search_points(
+        qdrant_client, target, embedding,
+        keyword_text=text if hybrid else None,
+        # Extra points since captions and descriptions of the same reel collapse into one result
+        limit=max(SEARCH_CANDIDATES if RERANKER_MODEL else 0, SEARCH_TOP_K * 2),
+        candidates=SEARCH_CANDIDATES,
+        query_filter=tenant_filter(collection_name) if SHARED_LAYOUT else None,
+        search_params=SEARCH_PARAMS
+    )
+    if RERANKER_MODEL:
+        points = reranker.get().rerank(text, points)
+    if SEARCH_SCORE_THRESHOLD and (RERANKER_MODEL or not hybrid):
+        points = [point for point in points if point.score >= SEARCH_SCORE_THRESHOLD]
+    search_result_cache.set(cache_key, points)
+    return points
 
-        # ToDo: send thumbs up reaction to the message
-        
-        link = response[0].payload.get("link", "No link available")
-        url = f"https://graph.instagram.com/v22.0/me/messages?access_token={get_access_token()}"
-        payload = {
-            "recipient": {"id": sender_id},
-            "message": {
-                "attachment": {
-                    "type": "video",
-                    "payload": {"url": link}
-                }
+def ranked_reels(points, limit):
+    """Distinct reels from ranked points (a reel can match by caption and by description), best first."""
+    results, seen = [], set()
+    for point in points:
+        payload = point.payload or {}
+        key = payload.get("reel_id") or payload.get("link")
+        if not payload.get("link") or key in seen:
+            continue
+        seen.add(key)
+        results.append({"link": payload["link"], "reel_id": payload.get("reel_id"), "score": point.score})
+        if len(results) == limit:
+            break
+    return results
+
+def send_similar_reel(sender_id, text, mid=None):
+    """
+    Search and send the best match. Returns the Graph API response, or a dict with "error"
+    when there is nothing to send (the user has been told). Qdrant and send errors raise.
+    `mid` (the search message) is marked processed as soon as the reel is sent.
+    """
+    logger.info(f"Started send_similar_reel")
+    response = get_similar_messages(collection_name=sender_id, text=text)
+    results = ranked_reels(response, SEARCH_TOP_K)
+    if not results:
+        logger.info("No results found.")
+        send_error_message(sender_id, "No similar reels found. Try a different search query.")
+        return {"error": "No similar messages found."}
+
+    search_sessions.start(sender_id, text, results)
+    response = send_reel(sender_id, results[0]["link"])
+    if mid:
+        mark_processed(mid, type="search")
+    if len(results) > 1:
+        send_error_message(sender_id, f"Best of {len(results)} matches. Send `next` for the next one.")
+    return response
+
+def send_next_reel(sender_id, mid):
+    """
+    Send the next result of the sender's last search from the session, without searching again.
+    Returns a dict with "error" when there is nothing to send (the user has been told); send errors raise.
+    The session only moves forward once per `next` message `mid`, which is marked processed once the reel is sent.
+    """
+    step = search_sessions.advance(sender_id, mid)
+    if step is None:
+        send_error_message(sender_id, "No recent search. Use `search <your query>` first.")
+        return {"error": "No search session."}
+    result, position, total = step
+    if result is None:
+        send_error_message(sender_id, f"That was the last of {total} matches. Try a different search query.")
+        return {"error": "Search results exhausted."}
+
+    response = send_reel(sender_id, result["link"])
+    mark_processed(mid, type="next")
+    send_error_message(sender_id, f"Match {position} of {total}.")
+    return response
+
+def send_reel(sender_id, link):
+    """Send a stored reel link as a video attachment. Raises RequestException if Instagram rejects it."""
+    url = f"{GRAPH_API_URL}/me/messages?access_token={get_access_token()}"
+    payload = {
+        "recipient": {"id": sender_id},
+        "message": {
+            "attachment": {
+                "type": "video",
+                "payload": {"url": link}
             }
         }
-        
-        logger.info(f"Request ready to send to URL `{url}` with payload: {payload}")
-        response = requests.post(url, json=payload)
-        
-        if response.status_code != 200:
-            if response.json().get('error').get('error_subcode'):
-                # ToDO: Implement logic to send reel in chunks if error_subcode indicates that
-                logging.error("Implement 'Sending reel in chunks logic'")
-                
-            raise requests.RequestException(f"Error sending similar reel response: {response.json().get('error', {}).get('message', 'Unknown error')}")            
-        return response
-    except requests.RequestException as exc:
-        send_error_message(sender_id, str(exc))
-        logger.error(f"Error in send_similar_reel: {exc}")
-        return {"error": f"Error sending similar reel response: {exc}"}
+    }
+    
+    logger.info(f"Request ready to send to URL `{url}` with payload: {payload}")
+    response = graph.post(url, json=payload)
+    
+    if response.status_code != 200:
+        if response.json().get('error').get('error_subcode'):
+            # ToDO: Implement logic to send reel in chunks if error_subcode indicates that
+            logging.error("Implement 'Sending reel in chunks logic'")
+            
+        raise requests.RequestException(f"Error sending similar reel response: {response.json().get('error', {}).get('message', 'Unknown error')}")            
+    return response
         
 def split_message(text, max_length=1000):
     """
@@ -490,7 +808,7 @@ def send_error_message(sender_id, error_message):
     message_chunks = split_message(error_message, max_length=1000)
     
     for i, chunk in enumerate(message_chunks):
-        url = f"https://graph.instagram.com/v22.0/me/messages?access_token={get_access_token()}"
+        url = f"{GRAPH_API_URL}/me/messages?access_token={get_access_token()}"
         payload = {
             "recipient": {"id": sender_id},
             "message": {
@@ -498,7 +816,7 @@ def send_error_message(sender_id, error_message):
             }
         }
         logger.info(f"Sending message chunk {i+1}/{len(message_chunks)} ({len(chunk)} chars)")
-        response = requests.post(url, json=payload)
+        response = graph.post(url, json=payload)
         if response.status_code != 200:
             logger.error(f"Error sending message chunk {i+1}: {response.json()['error']['message']}")
             return False
@@ -510,7 +828,7 @@ def send_error_message(sender_id, error_message):
     return True
 
 def send_reaction(sender_id, message_id, reaction_type=os.getenv("DEFAULT_REACTION_TYPE", "love")):
-    url = f"https://graph.instagram.com/v22.0/me/messages/?access_token={get_access_token()}"
+    url = f"{GRAPH_API_URL}/me/messages/?access_token={get_access_token()}"
     payload = {
         "recipient": {"id": sender_id},
         "sender_action": "react", # Or set to unreact to remove the reaction
@@ -519,7 +837,7 @@ def send_reaction(sender_id, message_id, reaction_type=os.getenv("DEFAULT_REACTI
             "reaction": reaction_type # Omit if removing a reaction
         }
     }
-    response = requests.post(url, json=payload)
+    response = graph.post(url, json=payload)
     if response.status_code != 200:
         logger.error(f"Error sending reaction: {response.json()['error']['message']}")
 
@@ -537,7 +855,7 @@ def exchange_for_long_lived_token(short_lived_token, client_id, client_secret):
         logger.debug(f"Token exchange request to: {url}")
         logger.debug(f"Token exchange payload keys: grant_type, client_secret, access_token")
         
-        response = requests.get(url)
+        response = graph.get(url)
         response_data = response.json()
         
         logger.debug(f"Token exchange response status: {response.status_code}")
@@ -553,16 +871,40 @@ def exchange_for_long_lived_token(short_lived_token, client_id, client_secret):
         logger.exception(f"Error exchanging token: {e}")
         return {"error": str(e)}
 
+# Process-level cache of the creds document so outbound messages don't query Mongo each time.
+# Re-read after TOKEN_CACHE_TTL seconds (picks up writes from other processes), when the token
+# expires, or immediately after this process stores/refreshes a token.
+TOKEN_CACHE_TTL = int(os.environ.get("TOKEN_CACHE_TTL", 300))
+_token_cache = {"doc": None, "loaded_at": 0.0}
+_token_lock = threading.Lock()
+
+def get_token_doc():
+    """Return the cached creds document, reloading it from Mongo when stale or expired."""
+    with _token_lock:
+        token_doc = _token_cache["doc"]
+        stale = time.monotonic() - _token_cache["loaded_at"] > TOKEN_CACHE_TTL
+        expired = token_doc is not None and token_doc.get("expires_at") and token_doc["expires_at"] <= datetime.now()
+        if token_doc is None or stale or expired:
+            token_doc = creds.find_one()
+            _token_cache["doc"] = token_doc
+            _token_cache["loaded_at"] = time.monotonic()
+        return token_doc
+
+def invalidate_access_token():
+    """Drop the cached token; call after writing a new token to the creds collection."""
+    with _token_lock:
+        _token_cache["doc"] = None
+        _token_cache["loaded_at"] = 0.0
+
 def get_access_token():
     """
-    Retrieves the Instagram access token from the database or environment variable.
+    Retrieves the Instagram access token from the process cache (backed by the database) or environment variable.
     Checks expiration and logs warning if token is expiring soon.
     If not found, returns env var as fallback.
     """
     try:
-        cred = list(creds.find())
-        if cred:
-            token_doc = cred[0]
+        token_doc = get_token_doc()
+        if token_doc:
             access_token = token_doc.get("access_token")
             expires_at = token_doc.get("expires_at")
             
@@ -579,11 +921,70 @@ def get_access_token():
     # Fallback to environment variable
     return os.getenv("INSTA_ACCESS_TOKEN")
 
-def run_gemini(url, is_reel):
+def refresh_long_lived_token(token_doc):
+    """
+    Refresh a stored long-lived token via the Graph API and update it in the database.
+    Returns the Graph API response data, or a dict with "error".
+    """
+    url = f"{GRAPH_API_URL}/refresh_access_token"
+    payload = {
+        "grant_type": "ig_refresh_token",
+        "access_token": token_doc.get("access_token")
+    }
+    response = graph.post(url, params=payload)
+    response_data = response.json()
+    
+    if response.status_code != 200 or response_data.get("error"):
+        logger.error(f"Token refresh failed: {response_data}")
+        return {"error": response_data.get("error", {}).get("message", "Unknown error")}
+    
+    new_token = response_data.get("access_token")
+    new_expires_in = response_data.get("expires_in", 60 * 24 * 60 * 60)
+    
+    # Update token in database
+    creds.update_one(
+        {"_id": token_doc.get("_id")},
+        {"$set": {
+            "access_token": new_token,
+            "expires_in": new_expires_in,
+            "created_at": datetime.now(),
+            "expires_at": datetime.now() + timedelta(seconds=new_expires_in),
+            "last_refreshed_at": datetime.now()
+        }}
+    )
+    invalidate_access_token()
+    logger.info("Successfully refreshed long-lived token")
+    return response_data
+
+def token_refresher():
+    """Background thread: refresh the long-lived token TOKEN_REFRESH_BEFORE_DAYS before it expires."""
+    refresh_before = int(os.environ.get("TOKEN_REFRESH_BEFORE_DAYS", 7)) * 24 * 60 * 60
+    interval = int(os.environ.get("TOKEN_REFRESH_CHECK_INTERVAL", 6 * 60 * 60))
+    while True:
+        try:
+            token_doc = get_token_doc()
+            expires_at = token_doc.get("expires_at") if token_doc else None
+            if expires_at and (expires_at - datetime.now()).total_seconds() < refresh_before:
+                logger.info(f"Access token expires at {expires_at}, refreshing proactively")
+                refresh_long_lived_token(token_doc)
+        except Exception as e:
+            logger.exception(f"Error in token refresher: {e}")
+        time.sleep(interval)
+
+
+def run_gemini(url, is_reel, media_key=None):
+    # Runs on the shared Gemini loop/client; this thread only waits for the caption.
+    # Cached captions for `media_key` or identical content are returned without calling Gemini.
+    return gemini_result(gemini.get().submit(url, is_reel, media_key=media_key))
+
+def gemini_result(future):
+    """Resolve a Gemini future into a caption or one of the sentinel error strings."""
+    from functions import FileTooLarge
     try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        return loop.run_until_complete(gemini(url, is_reel))
+        return future.result()
+    except FileTooLarge as e:
+        logger.error(f"Reel too large for Gemini: {e}")
+        return "File too large"
     except Exception as e:
         # Handle Gemini API quota/resource exhaustion
         if hasattr(e, 'response') and getattr(e.response, 'status_code', None) == 429:
@@ -621,7 +1022,7 @@ def home():
         "code": code
     }
 
-    response = requests.post("https://api.instagram.com/oauth/access_token", data=payload)
+    response = graph.post("https://api.instagram.com/oauth/access_token", data=payload)
     json_response = response.json()
     logging.info(f"Instagram OAuth response: {json_response}")
     
@@ -640,7 +1041,6 @@ def home():
     
     # Store long-lived token in database
     creds.delete_many({})
-    from datetime import timedelta
     creds.insert_one({
         "access_token": long_lived_token,
         "user_id": user_id,
@@ -649,6 +1049,7 @@ def home():
         "expires_at": datetime.now() + timedelta(seconds=expires_in),
         "token_type": "long_lived"
     })
+    invalidate_access_token()
     
     if request.method == "POST":
         return {"message": "Long-lived token obtained and stored successfully"}, 200
@@ -697,7 +1098,7 @@ def callback():
             "code": code
         }
         
-        short_lived_response = requests.post(
+        short_lived_response = graph.post(
             "https://api.instagram.com/oauth/access_token",
             data=short_lived_payload
         )
@@ -740,7 +1141,6 @@ def callback():
         logger.debug(f"Long-lived response: {long_lived_response}")
         
         # Step 3: Calculate expiration details
-        from datetime import timedelta
         expires_in_seconds = expires_in if expires_in else 60 * 24 * 60 * 60
         expires_in_days = expires_in_seconds / (24 * 3600)
         expires_at = datetime.now() + timedelta(seconds=expires_in_seconds)
@@ -762,6 +1162,7 @@ def callback():
         }
         
         inserted = creds.insert_one(token_record)
+        invalidate_access_token()
         logger.info(f"✓ Token stored in database with ID: {inserted.inserted_id}")
         
         # Step 5: Return comprehensive response with all details
@@ -824,8 +1225,6 @@ def refresh_token():
             return {"error": "No token stored in database"}, 400
         
         token_doc = cred[0]
-        access_token = token_doc.get("access_token")
-        user_id = token_doc.get("user_id")
         expires_at = token_doc.get("expires_at")
         
         # Check how much time is left
@@ -835,35 +1234,11 @@ def refresh_token():
                 return {"message": f"Token still valid for {time_until_expiry / (24 * 3600):.1f} days"}, 200
         
         # Refresh token using refresh endpoint
-        url = "https://graph.instagram.com/v22.0/refresh_access_token"
-        payload = {
-            "grant_type": "ig_refresh_token",
-            "access_token": access_token
-        }
-        response = requests.post(url, params=payload)
-        response_data = response.json()
-        
-        if response.status_code != 200 or response_data.get("error"):
-            logger.error(f"Token refresh failed: {response_data}")
-            return {"error": response_data.get("error", {}).get("message", "Unknown error")}, 400
-        
-        new_token = response_data.get("access_token")
+        response_data = refresh_long_lived_token(token_doc)
+        if response_data.get("error"):
+            return {"error": response_data.get("error")}, 400
         new_expires_in = response_data.get("expires_in", 60 * 24 * 60 * 60)
         
-        # Update token in database
-        from datetime import timedelta
-        creds.update_one(
-            {"_id": token_doc.get("_id")},
-            {"$set": {
-                "access_token": new_token,
-                "expires_in": new_expires_in,
-                "created_at": datetime.now(),
-                "expires_at": datetime.now() + timedelta(seconds=new_expires_in),
-                "last_refreshed_at": datetime.now()
-            }}
-        )
-        
-        logger.info("Successfully refreshed long-lived token")
         return {"message": "Token refreshed successfully", "expires_in_days": new_expires_in / (24 * 3600)}, 200
     
     except Exception as e:
@@ -906,74 +1281,275 @@ def token_status():
         logger.exception(f"Error getting token status: {e}")
         return {"error": str(e)}, 500
 
+@app.after_request
+def record_first_response(response):
+    if startup_stats["first_response_seconds"] is None:
+        startup_stats["first_response_seconds"] = round(time.perf_counter() - IMPORT_STARTED, 3)
+        logger.info(f"First response served {startup_stats['first_response_seconds']}s after import started")
+    return response
+
+@app.route('/ready', methods=["GET"])
+def ready():
+    """
+    Readiness probe: 200 once every component this role needs is initialized, 503 before that.
+    Also reports per-component load times and import-to-first-response time.
+    """
+    components = required_resources()
+    for resource in components:
+        # Retries anything not initialized yet, including components whose warm-up failed
+        if not resource.ready:
+            resource.warm_up()
+    is_ready = all(resource.ready for resource in components)
+    return {
+        "ready": is_ready,
+        "role": APP_ROLE,
+        "components": {resource.name: resource.status() for resource in components},
+        "startup": startup_stats
+    }, 200 if is_ready else 503
+
+@app.route('/cache-stats', methods=["GET"])
+def cache_stats():
+    """
+    Hit/miss counters for the search caches (tune SEARCH_CACHE_SIZE and SEARCH_CACHE_TTL)
+    and the Gemini caption cache: this process's, and totals across every live web/worker process.
+    """
+    process_stats = local_cache_stats()
+    try:
+        shared_stats.publish(process_stats)
+        totals = shared_stats.totals()
+    except Exception as e:
+        logger.error(f"Error reading shared cache stats: {e}")
+        totals = None
+    return {
+        **process_stats,
+        "known_collections": len(known_collections),
+        "all_processes": totals
+    }, 200
+
+def local_cache_stats():
+    return {
+        "query_embeddings": query_embedding_cache.stats(),
+        "search_results": search_result_cache.stats(),
+        "captions": caption_cache.stats()
+    }
+
+@app.route('/webhook-stats', methods=["GET"])
+def webhook_stats():
+    """
+    Webhook ack latency percentiles, dispatcher queue depth and job counts by type/status.
+    """
+    jobs = job_queue.stats()
+    return {
+        "fast_ack": WEBHOOK_FAST_ACK,
+        "queue_depth": jobs.get("event", {}).get("pending", 0),
+        "ack_latency": ack_latency_stats(),
+        "jobs": jobs
+    }, 200
+
+# Bulk conversation import: one Graph API page at a time, checkpointed in `imports`
+IMPORT_PAGE_SIZE = int(os.environ.get("IMPORT_PAGE_SIZE", 50))
+IMPORT_UPSERT_BATCH = int(os.environ.get("IMPORT_UPSERT_BATCH", 64))
+IMPORT_MESSAGE_FIELDS = "attachments,id,message,from,to,created_time,reactions,shares"
+BOT_USERNAME = "reel_sync_ai"
+
 @app.route("/conversations/<conversation_id>")
-def messages(conversation_id): 
-    response = requests.get(f'https://graph.instagram.com/v22.0/{conversation_id}/messages?fields=attachments,id,message,from,to,created_time,reactions,shares&access_token={get_access_token()}')
-    response = response.json()
-    messages = response.get("data")
-    file_name = f'{messages[0].get("from").get("username")} {messages[0].get("to").get("data")[0].get("username")}'
-    with open(f"{file_name}.json", 'w') as f:
-        f.write(json.dumps(messages))
-    while "paging" in response: 
-        if response.get("paging").get("next"):
-            next_url = response.get("paging").get("next")
-            response = requests.get(next_url).json()
-            messages.extend(response.get("data"))
-        else: 
-            with open(f"{file_name}.json", 'w') as f:
-                f.write(json.dumps(messages))
-            break
+def messages(conversation_id):
+    """
+    Queue a bulk import of a conversation's history; a worker runs import_conversation.
+    A failed import resumes from its last checkpoint, a finished one starts over.
+    """
+    state = imports.find_one({"conversation_id": conversation_id})
+    if state and state.get("status") in ("queued", "running"):
+        if state.get("job_id") and job_queue.status(state["job_id"]) in (PENDING, RUNNING):
+            return {"message": "Import already in progress", "status": import_status(state)}, 202
+        # The job was dead-lettered or is gone without updating the import; resume from the checkpoint
+        logger.warning(f"Import of {conversation_id} is '{state.get('status')}' but its job is not active, treating it as failed")
+        state["status"] = "failed"
 
-        logger.info(f"File name: {file_name}")
+    update = {"status": "queued", "queued_at": datetime.now(), "error": None}
+    if not state or state.get("status") == "done":
+        update.update({"after": None, "carry": None, "pages": 0, "messages": 0, "stored": 0, "started_at": None, "finished_at": None})
+    job_id = enqueue_job("import", conversation_id=conversation_id)
+    if not job_id:
+        return {"error": "Job queue is full, try again later"}, 503
+    update["job_id"] = str(job_id)
+    imports.update_one({"conversation_id": conversation_id}, {"$set": update}, upsert=True)
+    return {"message": "Import queued", "job_id": str(job_id)}, 202
+
+@app.route("/conversations/<conversation_id>/status")
+def conversation_import_status(conversation_id):
+    """Progress of a conversation import: status, pages and messages read, reels stored."""
+    state = imports.find_one({"conversation_id": conversation_id})
+    if not state:
+        return {"error": "No import found for this conversation"}, 404
+    return import_status(state), 200
+
+def import_status(state):
+    return {
+        "conversation_id": state["conversation_id"],
+        "status": state.get("status"),
+        "job_id": state.get("job_id"),
+        "pages": state.get("pages", 0),
+        "messages": state.get("messages", 0),
+        "stored": state.get("stored", 0),
+        "resumable": bool(state.get("after")),
+        "started_at": state["started_at"].isoformat() if state.get("started_at") else None,
+        "updated_at": state["updated_at"].isoformat() if state.get("updated_at") else None,
+        "finished_at": state["finished_at"].isoformat() if state.get("finished_at") else None,
+        "error": state.get("error")
+    }
+
+def pair_shared_reels(page, previous=None):
+    """
+    Pair each shared reel in `page` with the text message right before it, which serves as its
+    description. `previous` is the last message of the prior page so pairs spanning a page
+    boundary aren't lost. Returns (pairs, last message of this page).
+    """
+    pairs = []
+    for message in page:
+        if (message.get("shares") and message.get("from", {}).get("username") != BOT_USERNAME
+                and previous and previous.get("from", {}).get("username") != BOT_USERNAME and not previous.get("shares")):
+            pairs.append({
+                "id": previous.get("id"),
+                "sender_id": previous.get("from").get("id"),
+                "link": message["shares"]["data"][0]["link"],
+                "message": previous.get("message"),
+                "timestamp": int(datetime.fromisoformat(previous.get("created_time")).timestamp() * 1000)
+            })
+        previous = message
+    return pairs, previous
+
+def store_import_pairs(pairs):
+    """Embed and upsert pairs in IMPORT_UPSERT_BATCH chunks, per sender collection. Returns the number stored."""
+    by_sender = {}
+    for pair in pairs:
+        by_sender.setdefault(pair["sender_id"], []).append(pair)
+    stored = 0
+    for collection_name, sender_pairs in by_sender.items():
+        for start in range(0, len(sender_pairs), IMPORT_UPSERT_BATCH):
+            chunk = sender_pairs[start:start + IMPORT_UPSERT_BATCH]
+            result = store_embeddings(collection_name, chunk)
+            if "error" in result:
+                raise RuntimeError(result["error"])
+            stored += len(chunk)
+    return stored
+
+def import_conversation(conversation_id):
+    """
+    Background worker: embed and store shared reels (with the preceding message as description)
+    from a conversation. Each Graph API page is paired, embedded and upserted before the next is
+    fetched, and the paging cursor is checkpointed after every page, so memory stays flat and a
+    retried job resumes where the last attempt stopped.
+    """
+    state = imports.find_one_and_update(
+        {"conversation_id": conversation_id},
+        {"$set": {"status": "running", "updated_at": datetime.now()}, "$setOnInsert": {"pages": 0, "messages": 0, "stored": 0}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    if not state.get("started_at"):
+        imports.update_one({"_id": state["_id"]}, {"$set": {"started_at": datetime.now()}})
+    after, carry = state.get("after"), state.get("carry")
+    if after:
+        logger.info(f"Resuming import of {conversation_id} after page {state.get('pages', 0)}")
 
-    print(len(messages))
-    embedding_msg=[]
-    for i, message in enumerate(messages):
-        if message.get("from").get("username") == "reel_sync_ai":
-            continue
-        if message.get("shares"):
-            link = message["shares"]["data"][0]["link"]
-            if i>0 and not messages[i-1].get("from").get("username") == "reel_sync_ai" and not messages[i-1].get("shares"):
-                prev_message = messages[i-1]
-                embedding_msg.append({
-                    "id" : prev_message.get("id"),
-                    "sender_id": prev_message.get("from").get("id"),
-                    "link" : link,
-                    "message" : prev_message.get("message"),
-                    "timestamp" : int(datetime.fromisoformat(prev_message.get("created_time")).timestamp() * 1000)
-                })
-
-    with open(f"{file_name} embeddings.json", 'w') as f:
-        f.write(json.dumps(embedding_msg))
-    
-    logger.info("Starting Qdrant")
-    collection_name = prev_message.get("from").get("id")
-    qdrant_client = QdrantClient(url=os.environ.get("QDRANT_URL"), api_key=os.environ.get("QDRANT_API_KEY"))
     try:
-        qdrant_client.get_collection(collection_name)
-    except:
-        qdrant_client.create_collection(
-            collection_name=collection_name,
-            vectors_config=VectorParams(size=384, distance=Distance.COSINE)
+        while True:
+            params = {"fields": IMPORT_MESSAGE_FIELDS, "limit": IMPORT_PAGE_SIZE, "access_token": get_access_token()}
+            if after:
+                params["after"] = after
+            response = graph.get(f"{GRAPH_API_URL}/{conversation_id}/messages", params=params)
+            body = response.json()
+            if response.status_code != 200 or "error" in body:
+                raise RuntimeError(f"Graph API error fetching messages: {body.get('error', response.status_code)}")
+
+            page = body.get("data", [])
+            pairs, last = pair_shared_reels(page, carry)
+            stored = store_import_pairs(pairs)
+            paging = body.get("paging", {})
+            after = paging.get("cursors", {}).get("after") if paging.get("next") else None
+            # Only the fields pairing needs; the cursor and carry let the next attempt pick up here
+            carry = {key: last.get(key) for key in ("id", "from", "message", "created_time", "shares")} if last else carry
+            imports.update_one(
+                {"_id": state["_id"]},
+                {"$set": {"after": after, "carry": carry, "updated_at": datetime.now()},
+                 "$inc": {"pages": 1, "messages": len(page), "stored": stored}}
+            )
+            logger.info(f"Imported page of {len(page)} messages ({stored} reels) from {conversation_id}")
+            if not after:
+                break
+    except Exception as e:
+        imports.update_one({"_id": state["_id"]}, {"$set": {"status": "failed", "error": str(e), "updated_at": datetime.now()}})
+        raise
+
+    imports.update_one({"_id": state["_id"]}, {"$set": {"status": "done", "after": None, "carry": None, "finished_at": datetime.now(), "updated_at": datetime.now()}})
+    logger.info(f"Finished import of {conversation_id}")
+
+# What the user is told once a job has failed all JOB_MAX_ATTEMPTS attempts
+DEAD_JOB_MESSAGES = {
+    "attachment": "Error processing your reel, try again later",
+    "search": "Error processing search",
+    "next": "Error sending the next result",
+    "description": "Error processing your description",
+    "reply": "Error processing reply",
+}
+
+def on_dead_job(job, error):
+    """Dead-letter callback: tell the sender their message could not be handled."""
+    payload = job.get("payload", {})
+    sender_id = payload.get("sender_id") or payload.get("context", {}).get("sender_id")
+    message = DEAD_JOB_MESSAGES.get(job["type"])
+    if sender_id and message:
+        send_error_message(sender_id, message)
+    if job["type"] == "import":
+        # A worker that died mid-import never ran its own failure handling
+        imports.update_one(
+            {"conversation_id": payload.get("conversation_id"), "status": {"$in": ["queued", "running"]}},
+            {"$set": {"status": "failed", "error": str(error), "updated_at": datetime.now()}}
         )
-    logger.info(f"Found Collection {collection_name}")
-    embeddings_list = []
-    for message in embedding_msg:
-        embedding = EMBEDDING_MODEL.embed_query(message.get("message"))
-        embeddings_list.append({
-            "id": int(uuid.uuid4().int % (10**12)),  # Generate unique 12-digit ID
-            "vector": embedding,
-            "payload": message
-        })
-
-    logger.info(f"Setting embeddings")
-    qdrant_client.upsert(
-        collection_name=collection_name,
-        points=embeddings_list
-    )
-    print("done")
 
-    return "DONE", 200
+job_queue.on_dead = on_dead_job
+
+# Per-type in-flight limits. Attachment jobs mostly wait on Gemini without holding a thread.
+JOB_HANDLERS = {
+    "attachment": (handle_attachment, int(os.environ.get("JOB_CONCURRENCY_ATTACHMENT", 50))),
+    "search": (handle_search, int(os.environ.get("JOB_CONCURRENCY_SEARCH", 4))),
+    "next": (handle_next, int(os.environ.get("JOB_CONCURRENCY_NEXT", 4))),
+    "description": (handle_reel_description, int(os.environ.get("JOB_CONCURRENCY_DESCRIPTION", 4))),
+    "reply": (handle_reply_context, int(os.environ.get("JOB_CONCURRENCY_REPLY", 4))),
+    "import": (import_conversation, int(os.environ.get("JOB_CONCURRENCY_IMPORT", 1))),
+}
+
+def start_job_workers():
+    """Start one JobWorker per job type once Mongo is bootstrapped; they run on daemon threads."""
+    wait_for_mongo()
+    return [
+        JobWorker(job_queue, job_type, handler, executor, concurrency=concurrency, poll_interval=float(os.environ.get("JOB_POLL_INTERVAL", 1))).start()
+        for job_type, (handler, concurrency) in JOB_HANDLERS.items()
+    ]
+
+def required_resources():
+    """Lazily initialized components this process role depends on."""
+    if not RUNS_JOBS:
+        return [mongo]
+    return [mongo, qdrant, embedding_service, gemini] + ([reranker] if RERANKER_MODEL else [])
+
+# Background workers. Skipped when this file is re-imported as __mp_main__ by a spawned
+# embedding process (python app.py with EMBEDDING_PROCESSES set).
+IS_SPAWNED_CHILD = __name__ == "__mp_main__"
+if WARMUP_ON_START and not IS_SPAWNED_CHILD:
+    warm_up_in_background(required_resources())
+if not IS_SPAWNED_CHILD:
+    shared_stats.start(local_cache_stats)
+if RUNS_WEB and not IS_SPAWNED_CHILD:
+    threading.Thread(target=token_refresher, name="token-refresher", daemon=True).start()
+    if WEBHOOK_FAST_ACK:
+        threading.Thread(target=start_event_workers, name="webhook-dispatcher-start", daemon=True).start()
+if RUNS_JOBS and not IS_SPAWNED_CHILD:
+    threading.Thread(target=start_job_workers, name="job-worker-start", daemon=True).start()
+
+startup_stats["import_seconds"] = round(time.perf_counter() - IMPORT_STARTED, 3)
+logger.info(f"Import finished in {startup_stats['import_seconds']}s")
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=int(os.getenv("PORT", 8080)), debug=True)
\ No newline at end of file
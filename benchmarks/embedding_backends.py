@@ -0,0 +1,138 @@
+"""
+Compare embedding backends on latency, throughput, RSS and agreement with the PyTorch model.
+
+Usage (from the project root):
+    python benchmarks/embedding_backends.py [--corpus texts.txt] [--backends huggingface onnx onnx-int8]
+
+Each backend runs in its own subprocess so RSS numbers are not mixed. The corpus is one text
+per line (e.g. exported reel captions); a small built-in sample is used when omitted.
+Agreement is the cosine similarity between each backend's vectors and the huggingface vectors.
+"""
+import argparse, json, os, subprocess, sys, tempfile, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SAMPLE_CORPUS = [
+    "A guy tasting something spicy and can't control his emotions and tears up.",
+    "A golden retriever catches a frisbee mid-air on the beach at sunset.",
+    "Chef shows how to fold dumplings in three quick steps, \"pinch, fold, press\".",
+    "Two cats knock a glass off the kitchen counter while the owner watches.",
+    "A street performer plays violin in the subway, people stop to film.",
+    "Time-lapse of a city skyline from day to night with traffic trails.",
+    "Gym tutorial: correct deadlift form, keep your back straight.",
+    "A toddler laughs uncontrollably at a dog sneezing.",
+    "Recipe for a 5-minute mug cake with chocolate chips.",
+    "Comedian jokes about airport security lines, \"take your shoes off again?\"",
+    "Drone shot of waves crashing against cliffs on the Irish coast.",
+    "Makeup artist transforms into a movie villain in under a minute.",
+    "Someone builds a tiny wooden house for a hamster.",
+    "Football player scores a bicycle kick goal in the last minute.",
+    "A grandmother reacts to her first virtual reality game.",
+    "Tips for saving money on groceries, buy in bulk and plan meals.",
+]
+
+def rss_mb():
+    """Current resident set size in MB (Linux), falling back to peak RSS."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+def run_backend(name, corpus, batch_size, repeats, vectors_path):
+    """Child process: measure one backend and dump its vectors for the agreement check."""
+    from embeddings import create_backend
+
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    backend = create_backend(name, batch_size=batch_size)
+    load_seconds = time.perf_counter() - started
+    backend.embed_documents(corpus[:2])  # warm-up
+
+    latencies = []
+    for _ in range(repeats):
+        for text in corpus:
+            started = time.perf_counter()
+            backend.embed_query(text)
+            latencies.append(time.perf_counter() - started)
+
+    texts = corpus * repeats
+    started = time.perf_counter()
+    vectors = []
+    for i in range(0, len(texts), batch_size):
+        vectors.extend(backend.embed_documents(texts[i:i + batch_size]))
+    throughput = len(texts) / (time.perf_counter() - started)
+
+    with open(vectors_path, "w") as f:
+        json.dump(vectors[:len(corpus)], f)
+    return {
+        "backend": backend.name,
+        "load_seconds": round(load_seconds, 2),
+        "latency_p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "latency_p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "throughput_per_s": round(throughput, 1),
+        "rss_mb": round(rss_mb(), 1),
+        "rss_model_mb": round(rss_mb() - rss_before, 1),
+    }
+
+def cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = (sum(x * x for x in a) ** 0.5) * (sum(y * y for y in b) ** 0.5)
+    return dot / norm if norm else 0.0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="Text file with one document per line")
+    parser.add_argument("--backends", nargs="+", default=["huggingface", "onnx", "onnx-int8"])
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--vectors", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.corpus:
+        with open(args.corpus) as f:
+            corpus = [line.strip() for line in f if line.strip()]
+    else:
+        corpus = SAMPLE_CORPUS
+
+    if args.child:
+        print(json.dumps(run_backend(args.child, corpus, args.batch_size, args.repeats, args.vectors)))
+        return
+
+    results, vectors = [], {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in args.backends:
+            vectors_path = os.path.join(tmp, f"{name}.json")
+            command = [sys.executable, os.path.abspath(__file__), "--child", name, "--vectors", vectors_path,
+                       "--batch-size", str(args.batch_size), "--repeats", str(args.repeats)]
+            if args.corpus:
+                command += ["--corpus", args.corpus]
+            output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+            with open(vectors_path) as f:
+                vectors[name] = json.load(f)
+
+    reference = vectors.get("huggingface")
+    for result, name in zip(results, args.backends):
+        if reference and name != "huggingface":
+            similarities = [cosine(a, b) for a, b in zip(reference, vectors[name])]
+            result["cosine_mean"] = round(sum(similarities) / len(similarities), 5)
+            result["cosine_min"] = round(min(similarities), 5)
+
+    print(f"{len(corpus)} texts, batch size {args.batch_size}, {args.repeats} repeats")
+    columns = ["backend", "load_seconds", "latency_p50_ms", "latency_p95_ms", "throughput_per_s", "rss_mb", "rss_model_mb", "cosine_mean", "cosine_min"]
+    print(" | ".join(columns))
+    for result in results:
+        print(" | ".join(str(result.get(column, "-")) for column in columns))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Compare dense, hybrid (dense + BM25, RRF) and cross-encoder reranked search on recall and latency.
+
+Usage (from the project root):
+    python benchmarks/hybrid_search.py [--dataset searches.json] [--reranker cross-encoder/ms-marco-MiniLM-L-6-v2]
+
+The dataset is JSON with stored texts and labelled searches, e.g. exported captions and
+descriptions plus past `search` queries with the reel the user wanted:
+    {"documents": [{"id": "r1", "text": "..."}],
+     "queries": [{"query": "...", "relevant": ["r1"]}]}
+A small built-in sample mixing paraphrases and exact words (names, quotes) is used when omitted.
+Everything runs against an in-memory Qdrant with the same collection layout as the app.
+"""
+import argparse, json, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_backends import SAMPLE_CORPUS, percentile
+
+SAMPLE_QUERIES = [
+    ("someone crying after eating hot food", [0]),
+    ("dog catching a frisbee", [1]),
+    ("pinch fold press", [2]),
+    ("cats being naughty in the kitchen", [3]),
+    ("violin subway", [4]),
+    ("city timelapse at night", [5]),
+    ("deadlift form", [6]),
+    ("baby laughing at a sneezing dog", [7]),
+    ("mug cake", [8]),
+    ("take your shoes off again", [9]),
+    ("Irish coast", [10]),
+    ("makeup villain transformation", [11]),
+    ("hamster house", [12]),
+    ("bicycle kick", [13]),
+    ("grandma tries VR", [14]),
+    ("how to spend less on food shopping", [15]),
+]
+
+def load_dataset(path):
+    if not path:
+        documents = [{"id": str(i), "text": text} for i, text in enumerate(SAMPLE_CORPUS)]
+        queries = [{"query": query, "relevant": [str(i) for i in relevant]} for query, relevant in SAMPLE_QUERIES]
+        return documents, queries
+    with open(path) as f:
+        data = json.load(f)
+    return data["documents"], data["queries"]
+
+def build_collection(qdrant_client, backend, documents, batch_size):
+    from hybrid import SPARSE_VECTOR_NAME, bm25_document_vector
+    from vector_store import create_collection, point_id
+
+    create_collection(qdrant_client, "benchmark", hybrid=True)
+    for start in range(0, len(documents), batch_size):
+        chunk = documents[start:start + batch_size]
+        vectors = backend.embed_documents([document["text"] for document in chunk])
+        qdrant_client.upsert(collection_name="benchmark", points=[{
+            "id": point_id(document["id"]),
+            "vector": {"": vector, SPARSE_VECTOR_NAME: bm25_document_vector(document["text"])},
+            "payload": {"doc_id": str(document["id"]), "message": document["text"]}
+        } for document, vector in zip(chunk, vectors)])
+
+def evaluate(name, search, queries, k):
+    """Run every query through `search(text) -> points` and score the ranked doc ids."""
+    latencies, hits_at_1, hits_at_k, reciprocal_ranks = [], 0, 0, 0.0
+    for item in queries:
+        started = time.perf_counter()
+        points = search(item["query"])
+        latencies.append(time.perf_counter() - started)
+        ranked = [point.payload["doc_id"] for point in points[:k]]
+        relevant = set(map(str, item["relevant"]))
+        rank = next((i + 1 for i, doc_id in enumerate(ranked) if doc_id in relevant), None)
+        hits_at_1 += rank == 1
+        hits_at_k += rank is not None
+        reciprocal_ranks += 1 / rank if rank else 0.0
+    return {
+        "mode": name,
+        "recall@1": round(hits_at_1 / len(queries), 3),
+        f"recall@{k}": round(hits_at_k / len(queries), 3),
+        f"mrr@{k}": round(reciprocal_ranks / len(queries), 3),
+        "latency_p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "latency_p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", help="JSON file with documents and labelled queries")
+    parser.add_argument("--backend", default=None, help="Embedding backend (default EMBEDDING_BACKEND or huggingface)")
+    parser.add_argument("--reranker", help="Cross-encoder model to also benchmark reranking")
+    parser.add_argument("--k", type=int, default=5, help="Cutoff for recall@k and MRR")
+    parser.add_argument("--candidates", type=int, default=20, help="Candidates per retriever before fusion/reranking")
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    from qdrant_client import QdrantClient
+    from embeddings import create_backend
+    from hybrid import CrossEncoderReranker
+    from vector_store import search_points
+
+    documents, queries = load_dataset(args.dataset)
+    backend = create_backend(args.backend, batch_size=args.batch_size)
+    qdrant_client = QdrantClient(":memory:")
+    build_collection(qdrant_client, backend, documents, args.batch_size)
+
+    limit = max(args.k, args.candidates)
+    def dense(text):
+        return search_points(qdrant_client, "benchmark", backend.embed_query(text), limit=limit, candidates=args.candidates)
+    def hybrid(text):
+        return search_points(qdrant_client, "benchmark", backend.embed_query(text), keyword_text=text, limit=limit, candidates=args.candidates)
+
+    modes = [("dense", dense), ("hybrid", hybrid)]
+    if args.reranker:
+        reranker = CrossEncoderReranker(args.reranker)
+        modes += [
+            ("dense+rerank", lambda text: reranker.rerank(text, dense(text))),
+            ("hybrid+rerank", lambda text: reranker.rerank(text, hybrid(text))),
+        ]
+
+    for _, search in modes:
+        search(queries[0]["query"])  # warm-up
+    results = [evaluate(name, search, queries, args.k) for name, search in modes]
+
+    print(f"{len(documents)} documents, {len(queries)} queries, backend {backend.name}, {args.candidates} candidates")
+    columns = list(results[0].keys())
+    print(" | ".join(columns))
+    for result in results:
+        print(" | ".join(str(result[column]) for column in columns))
+
+if __name__ == '__main__':
+    main()
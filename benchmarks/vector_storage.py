@@ -0,0 +1,150 @@
+"""
+Memory vs. recall for Qdrant vector storage settings (float32, scalar/binary quantization, on-disk).
+
+Usage (from the project root, against a disposable Qdrant; collections named bench_* are
+created and deleted):
+    python benchmarks/vector_storage.py [--qdrant-url http://localhost:6333] [--points 20000] [--corpus texts.txt]
+
+Vectors are MiniLM embeddings of `--corpus` (one text per line) when given, otherwise
+synthetic clustered 384-dim unit vectors. Recall@k is measured against exact brute-force
+cosine search. RAM is Qdrant's sizing estimate for the vectors (x1.5 for the index) plus
+the change in the server's resident memory reported by /metrics, when available.
+"""
+import argparse, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_backends import percentile
+
+CONFIGS = {
+    "float32": {},
+    "float32-ondisk": {"on_disk_vectors": True, "on_disk_payload": True},
+    "scalar": {"quantization": "scalar"},
+    "scalar-ondisk": {"quantization": "scalar", "on_disk_vectors": True, "on_disk_payload": True},
+    "scalar-norescore": {"quantization": "scalar", "rescore": False},
+    "binary": {"quantization": "binary"},
+    "binary-ondisk": {"quantization": "binary", "on_disk_vectors": True, "on_disk_payload": True},
+    "binary-norescore": {"quantization": "binary", "rescore": False},
+}
+
+def synthetic_vectors(np, count, dimension, clusters=50, seed=7):
+    """Unit vectors around random cluster centres, roughly like embeddings of related captions."""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dimension))
+    vectors = centres[rng.integers(0, clusters, count)] + rng.normal(scale=0.6, size=(count, dimension))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+def corpus_vectors(np, path, backend_name, batch_size):
+    from embeddings import create_backend
+    with open(path) as f:
+        texts = [line.strip() for line in f if line.strip()]
+    backend = create_backend(backend_name, batch_size=batch_size)
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        vectors.extend(backend.embed_documents(texts[start:start + batch_size]))
+    return np.asarray(vectors, dtype=np.float32)
+
+def server_rss_mb(url, api_key):
+    import requests
+    try:
+        response = requests.get(f"{url}/metrics", headers={"api-key": api_key} if api_key else None, timeout=5)
+        for line in response.text.splitlines():
+            if line.startswith("memory_resident_bytes "):
+                return float(line.split()[1]) / 2**20
+    except requests.RequestException:
+        pass
+    return None
+
+def estimated_ram_mb(config, count, dimension):
+    """Vectors kept in RAM, with Qdrant's x1.5 allowance for the HNSW graph and overhead."""
+    original = 0 if config.on_disk_vectors else count * dimension * 4
+    quantized = {"scalar": count * dimension, "binary": count * dimension / 8}.get(config.quantization, 0)
+    if not config.quantization_always_ram:
+        quantized = 0
+    return (original + quantized) * 1.5 / 2**20
+
+def wait_until_indexed(qdrant_client, collection_name, timeout=600):
+    from qdrant_client.http.models import CollectionStatus
+    deadline = time.monotonic() + timeout
+    while qdrant_client.get_collection(collection_name).status != CollectionStatus.GREEN:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{collection_name} still optimizing after {timeout}s")
+        time.sleep(1)
+
+def run_config(qdrant_client, name, config, vectors, queries, truth, k, url, api_key, batch_size=512):
+    from vector_store import create_collection, search_points
+
+    collection_name = f"bench_{name}"
+    if qdrant_client.collection_exists(collection_name):
+        qdrant_client.delete_collection(collection_name)
+    rss_before = server_rss_mb(url, api_key)
+    create_collection(qdrant_client, collection_name, config=config)
+    try:
+        started = time.perf_counter()
+        for start in range(0, len(vectors), batch_size):
+            qdrant_client.upsert(collection_name=collection_name, points=[
+                {"id": start + i, "vector": vector.tolist(), "payload": {"message": f"point {start + i}"}}
+                for i, vector in enumerate(vectors[start:start + batch_size])
+            ], wait=True)
+        wait_until_indexed(qdrant_client, collection_name)
+        load_seconds = time.perf_counter() - started
+        rss_after = server_rss_mb(url, api_key)
+
+        search_params = config.search_params()
+        latencies, found = [], 0
+        for query, expected in zip(queries, truth):
+            started = time.perf_counter()
+            points = search_points(qdrant_client, collection_name, query.tolist(), limit=k, search_params=search_params)
+            latencies.append(time.perf_counter() - started)
+            found += len({point.id for point in points} & set(expected))
+    finally:
+        qdrant_client.delete_collection(collection_name)
+
+    return {
+        "config": name,
+        f"recall@{k}": round(found / (len(queries) * k), 4),
+        "latency_p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "latency_p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "est_ram_mb": round(estimated_ram_mb(config, len(vectors), vectors.shape[1]), 1),
+        "server_rss_delta_mb": round(rss_after - rss_before, 1) if rss_before is not None and rss_after is not None else "-",
+        "load_seconds": round(load_seconds, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--qdrant-url", default=os.environ.get("QDRANT_URL", "http://localhost:6333"))
+    parser.add_argument("--points", type=int, default=20000, help="Synthetic vectors to index (ignored with --corpus)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--corpus", help="Text file with one document per line to embed instead of synthetic vectors")
+    parser.add_argument("--backend", default=None, help="Embedding backend for --corpus")
+    parser.add_argument("--configs", nargs="+", default=list(CONFIGS), choices=list(CONFIGS))
+    args = parser.parse_args()
+
+    import numpy as np
+    from qdrant_client import QdrantClient
+    from embeddings import EMBEDDING_DIMENSION
+    from vector_config import VectorConfig
+
+    api_key = os.environ.get("QDRANT_API_KEY")
+    if args.corpus:
+        data = corpus_vectors(np, args.corpus, args.backend, 32)
+        queries, vectors = data[:args.queries], data[args.queries:]
+    else:
+        data = synthetic_vectors(np, args.points + args.queries, EMBEDDING_DIMENSION)
+        queries, vectors = data[:args.queries], data[args.queries:]
+    # Exact top-k by cosine (vectors are normalized) as ground truth
+    truth = np.argsort(-(queries @ vectors.T), axis=1)[:, :args.k].tolist()
+
+    qdrant_client = QdrantClient(url=args.qdrant_url, api_key=api_key, timeout=120)
+    results = [run_config(qdrant_client, name, VectorConfig(**CONFIGS[name]), vectors, queries, truth, args.k, args.qdrant_url, api_key)
+               for name in args.configs]
+
+    print(f"{len(vectors)} vectors, {len(queries)} queries, k={args.k}")
+    columns = list(results[0].keys())
+    print(" | ".join(columns))
+    for result in results:
+        print(" | ".join(str(result[column]) for column in columns))
+
+if __name__ == '__main__':
+    main()
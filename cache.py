@@ -0,0 +1,210 @@
+import logging, os, socket, threading, time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pymongo import UpdateOne
+
+from mongo_schema import ensure_ttl_index
+
+logger = logging.getLogger(__name__)
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds. Tracks hits and misses."""
+
+    def __init__(self, maxsize=1024, ttl=600):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires_at = item
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate(self, predicate):
+        """Drop every entry whose key matches `predicate`. Returns the number removed."""
+        with self._lock:
+            stale = [key for key in self._data if predicate(key)]
+            for key in stale:
+                del self._data[key]
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None
+            }
+
+def normalize_query(text):
+    """Normalize a search query for cache keys: case-folded with collapsed whitespace."""
+    return " ".join((text or "").lower().split())
+
+class CaptionCache:
+    """
+    Mongo-backed cache of Gemini captions shared by every process.
+    Keys are `reel:<reel_video_id>`, `post:<ig_post_media_id>` or `sha256:<content hash>`;
+    documents expire `ttl` seconds after they are written (TTL index on `created_at`).
+    Lookup failures are logged and treated as misses so captioning never depends on the cache.
+    """
+
+    def __init__(self, collection, ttl=30 * 24 * 60 * 60):
+        self.collection = collection
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.by_kind = {}
+        self._lock = threading.Lock()
+
+    def ensure_indexes(self):
+        self.collection.create_index("key", unique=True)
+        ensure_ttl_index(self.collection, "created_at", self.ttl)
+
+    def get(self, key):
+        try:
+            doc = self.collection.find_one({"key": key}, {"caption": 1})
+        except Exception as e:
+            logger.error(f"Error reading caption cache for {key}: {e}")
+            doc = None
+        with self._lock:
+            kind = self.by_kind.setdefault(key.split(":", 1)[0], {"hits": 0, "misses": 0})
+            if doc:
+                self.hits += 1
+                kind["hits"] += 1
+            else:
+                self.misses += 1
+                kind["misses"] += 1
+        return doc.get("caption") if doc else None
+
+    def set(self, keys, caption):
+        if not keys:
+            return
+        now = datetime.now(timezone.utc)
+        try:
+            self.collection.bulk_write([
+                UpdateOne({"key": key}, {"$set": {"caption": caption, "created_at": now}}, upsert=True)
+                for key in keys
+            ], ordered=False)
+        except Exception as e:
+            logger.error(f"Error writing caption cache for {keys}: {e}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "by_kind": {name: dict(counts) for name, counts in self.by_kind.items()}
+            }
+
+class CacheGenerations:
+    """
+    Per-name generation counters in Mongo, bumped whenever the data behind a name (e.g. a
+    Qdrant collection) changes. Processes put the current generation in their local cache
+    keys, so a write in any process makes every other process's cached entries unreachable.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def get(self, name):
+        doc = self.collection.find_one({"_id": name}, {"generation": 1})
+        return doc["generation"] if doc else 0
+
+    def bump(self, name):
+        self.collection.update_one({"_id": name}, {"$inc": {"generation": 1}}, upsert=True)
+
+class SharedStats:
+    """
+    Cache counters of every process, one Mongo document per process refreshed every
+    `interval` seconds and expiring `ttl` seconds after its last report. Lets any process
+    (e.g. the web tier, whose own caption/search counters stay at zero) report deployment totals.
+    """
+
+    def __init__(self, collection, interval=30, ttl=10 * 60):
+        self.collection = collection
+        self.interval = interval
+        self.ttl = ttl
+        self.process_id = f"{socket.gethostname()}-{os.getpid()}"
+
+    def ensure_indexes(self):
+        ensure_ttl_index(self.collection, "updated_at", self.ttl)
+
+    def publish(self, stats):
+        self.collection.update_one(
+            {"_id": self.process_id},
+            {"$set": {"stats": stats, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+
+    def start(self, collect):
+        """Publish `collect()` every `interval` seconds on a daemon thread."""
+        def run():
+            while True:
+                try:
+                    self.publish(collect())
+                except Exception as e:
+                    logger.error(f"Error publishing cache stats: {e}")
+                time.sleep(self.interval)
+        thread = threading.Thread(target=run, name="cache-stats", daemon=True)
+        thread.start()
+        return thread
+
+    def totals(self):
+        """Summed hits/misses (and sizes, per-kind caption counters) across live processes."""
+        totals, processes = {}, 0
+        for doc in self.collection.find({}, {"stats": 1}):
+            processes += 1
+            for name, stats in (doc.get("stats") or {}).items():
+                total = totals.setdefault(name, {"hits": 0, "misses": 0})
+                for field in ("hits", "misses", "size"):
+                    if field in stats:
+                        total[field] = total.get(field, 0) + stats[field]
+                for kind, counts in (stats.get("by_kind") or {}).items():
+                    kind_total = total.setdefault("by_kind", {}).setdefault(kind, {"hits": 0, "misses": 0})
+                    kind_total["hits"] += counts.get("hits", 0)
+                    kind_total["misses"] += counts.get("misses", 0)
+        for total in totals.values():
+            lookups = total["hits"] + total["misses"]
+            total["hit_rate"] = round(total["hits"] / lookups, 4) if lookups else None
+        return {"processes": processes, **totals}
+
+def media_cache_key(reel_id=None, post_id=None):
+    """Caption cache key for an Instagram attachment, or None when it carries no media id."""
+    if reel_id:
+        return f"reel:{reel_id}"
+    if post_id:
+        return f"post:{post_id}"
+    return None
@@ -0,0 +1,318 @@
+import atexit, os, logging, queue, threading, time
+import multiprocessing
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+MODEL_REPO = f"sentence-transformers/{MODEL_NAME}"
+EMBEDDING_DIMENSION = 384
+
+class EmbeddingBackend:
+    """
+    Interface for embedding backends. Implementations return 384-dim, L2-normalized
+    MiniLM vectors so they can read and write the same Qdrant collections.
+    """
+    name = "base"
+    dimension = EMBEDDING_DIMENSION
+
+    def embed_documents(self, texts):
+        raise NotImplementedError
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+class HuggingFaceBackend(EmbeddingBackend):
+    """sentence-transformers (PyTorch) through langchain's HuggingFaceEmbeddings."""
+    name = "huggingface"
+
+    def __init__(self, batch_size=32):
+        from langchain_huggingface import HuggingFaceEmbeddings
+        self.model = HuggingFaceEmbeddings(model_name=MODEL_NAME, encode_kwargs={"batch_size": batch_size})
+
+    def embed_documents(self, texts):
+        return self.model.embed_documents(texts)
+
+class OnnxBackend(EmbeddingBackend):
+    """
+    MiniLM on ONNX Runtime (CPU). Reproduces the sentence-transformers pipeline: WordPiece
+    tokenization truncated to 256 tokens, mean pooling over the attention mask and L2 normalization.
+    With `quantized=True` the model is dynamically quantized to int8 once and saved next to the fp32 model.
+    """
+    name = "onnx"
+    max_length = 256
+
+    def __init__(self, quantized=False, model_path=None, cache_dir=None, threads=None):
+        import numpy as np
+        import onnxruntime as ort
+        from huggingface_hub import hf_hub_download
+        from tokenizers import Tokenizer
+
+        self.np = np
+        self.quantized = quantized
+        model_path = model_path or hf_hub_download(MODEL_REPO, "onnx/model.onnx", cache_dir=cache_dir)
+        if quantized:
+            model_path = self._quantize(model_path)
+
+        self.tokenizer = Tokenizer.from_file(hf_hub_download(MODEL_REPO, "tokenizer.json", cache_dir=cache_dir))
+        self.tokenizer.enable_truncation(max_length=self.max_length)
+        self.tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        if self.quantized:
+            self.name = "onnx-int8"
+
+    @staticmethod
+    def _quantize(model_path):
+        quantized_path = model_path.replace(".onnx", "_dynamic_int8.onnx")
+        if not os.path.exists(quantized_path):
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            logger.info(f"Quantizing {model_path} to int8")
+            quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8)
+        return quantized_path
+
+    def embed_documents(self, texts):
+        np = self.np
+        if not texts:
+            return []
+        encodings = self.tokenizer.encode_batch([text or "" for text in texts])
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+
+        token_embeddings = self.session.run(None, feeds)[0]
+        mask = attention_mask[..., None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.tolist()
+
+def create_backend(name=None, batch_size=32):
+    """Build the backend selected by `name` or EMBEDDING_BACKEND ("huggingface" or "onnx")."""
+    name = (name or os.environ.get("EMBEDDING_BACKEND", "huggingface")).lower()
+    if name == "huggingface":
+        return HuggingFaceBackend(batch_size=batch_size)
+    if name in ("onnx", "onnx-int8"):
+        return OnnxBackend(
+            quantized=name == "onnx-int8" or os.environ.get("EMBEDDING_ONNX_QUANTIZED", "False").lower() == "true",
+            model_path=os.environ.get("EMBEDDING_ONNX_PATH"),
+            threads=int(os.environ["EMBEDDING_ONNX_THREADS"]) if os.environ.get("EMBEDDING_ONNX_THREADS") else None
+        )
+    raise ValueError(f"Unknown EMBEDDING_BACKEND '{name}'")
+
+def _embedding_process(backend_name, batch_size, shm_name, conn):
+    """Worker process loop: embed text batches with a private model copy and write float32 vectors into shared memory."""
+    import numpy as np
+    from multiprocessing import shared_memory
+
+    try:
+        backend = create_backend(backend_name, batch_size=batch_size)
+        shm = shared_memory.SharedMemory(name=shm_name)
+        output = np.ndarray((batch_size, EMBEDDING_DIMENSION), dtype=np.float32, buffer=shm.buf)
+    except Exception as e:
+        conn.send(("error", repr(e)))
+        return
+    conn.send(("ready", backend.name))
+
+    while True:
+        texts = conn.recv()
+        if texts is None:
+            break
+        try:
+            output[:len(texts)] = np.asarray(backend.embed_documents(texts), dtype=np.float32)
+            conn.send(("ok", len(texts)))
+        except Exception as e:
+            conn.send(("error", repr(e)))
+    del output
+    shm.close()
+
+class ProcessPoolBackend(EmbeddingBackend):
+    """
+    Runs `processes` worker processes, each holding its own copy of the `inner` backend, so
+    embedding uses several cores instead of one GIL-bound thread. Texts go to a worker over a
+    pipe; vectors come back through a per-worker shared-memory float32 buffer instead of
+    pickled lists. Each call blocks on one idle worker, so run one caller thread per process
+    (see BatchEmbedder `workers`). A worker process that dies is replaced (or dropped if it
+    can't be restarted), and the shared memory is released at interpreter exit.
+    """
+
+    def __init__(self, inner="huggingface", processes=2, batch_size=32):
+        self.inner = inner
+        self.batch_size = batch_size
+        self.name = f"{inner} x{processes} processes"
+        self._idle = queue.Queue()
+        # spawn: forking a process that already holds torch/onnx threads is unsafe
+        self._context = multiprocessing.get_context("spawn")
+        self._workers = [self._spawn(index) for index in range(processes)]
+        atexit.register(self.close)
+
+        for index in range(processes):
+            try:
+                self._wait_ready(index)
+            except RuntimeError:
+                self.close()
+                raise
+            self._idle.put(index)
+        logger.info(f"Started {processes} embedding processes ({inner})")
+
+    def _spawn(self, index):
+        import numpy as np
+        from multiprocessing import shared_memory
+
+        shm = shared_memory.SharedMemory(create=True, size=self.batch_size * EMBEDDING_DIMENSION * 4)
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_embedding_process, args=(self.inner, self.batch_size, shm.name, child_conn), name=f"embedding-{index}", daemon=True)
+        process.start()
+        # Only the child holds its end, so recv() raises EOFError if the child dies
+        child_conn.close()
+        return {
+            "process": process,
+            "conn": parent_conn,
+            "shm": shm,
+            "buffer": np.ndarray((self.batch_size, EMBEDDING_DIMENSION), dtype=np.float32, buffer=shm.buf)
+        }
+
+    def _wait_ready(self, index):
+        try:
+            status, value = self._workers[index]["conn"].recv()
+        except (EOFError, OSError) as e:
+            status, value = "error", repr(e)
+        if status != "ready":
+            raise RuntimeError(f"Embedding process {index} failed to start: {value}")
+
+    def embed_documents(self, texts):
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._embed_chunk(texts[start:start + self.batch_size]))
+        return vectors
+
+    def _embed_chunk(self, texts):
+        index = self._take_idle()
+        worker = self._workers[index]
+        try:
+            worker["conn"].send(list(texts))
+            status, value = worker["conn"].recv()
+        except (EOFError, OSError) as e:
+            # The process died (OOM kill, crash); don't hand it out again
+            self._replace(index)
+            raise RuntimeError(f"Embedding process {index} died: {e!r}") from e
+        self._idle.put(index)
+        if status != "ok":
+            raise RuntimeError(f"Embedding process {index} failed: {value}")
+        # Copy out of shared memory before the worker is handed the next batch
+        return worker["buffer"][:value].tolist()
+
+    def _take_idle(self, poll=1.0):
+        """Wait for an idle worker, re-checking every `poll` seconds that any are left."""
+        while True:
+            if not any(self._workers):
+                raise RuntimeError("No embedding processes left")
+            try:
+                return self._idle.get(timeout=poll)
+            except queue.Empty:
+                continue
+
+    def _replace(self, index):
+        """Tear down a dead worker and start a new one in its slot; drop the slot if that fails."""
+        logger.error(f"Embedding process {index} died, restarting it")
+        self._release(self._workers[index])
+        self._workers[index] = None
+        try:
+            self._workers[index] = self._spawn(index)
+            self._wait_ready(index)
+        except Exception as e:
+            logger.error(f"Could not restart embedding process {index}, continuing without it: {e}")
+            if self._workers[index] is not None:
+                self._release(self._workers[index])
+                self._workers[index] = None
+            return
+        self._idle.put(index)
+
+    @staticmethod
+    def _release(worker):
+        try:
+            worker["conn"].send(None)
+        except (OSError, ValueError):
+            pass
+        worker["process"].join(timeout=5)
+        if worker["process"].is_alive():
+            worker["process"].terminate()
+        worker["conn"].close()
+        del worker["buffer"]
+        worker["shm"].close()
+        worker["shm"].unlink()
+
+    def close(self):
+        for worker in self._workers:
+            if worker is not None:
+                self._release(worker)
+        self._workers = []
+
+class BatchEmbedder:
+    """
+    Micro-batching front end for an embedding model.
+    Callers on any thread submit texts; `workers` background threads (one per embedding
+    process when using ProcessPoolBackend) merge pending requests into shared
+    `embed_documents` calls of up to `batch_size` texts, waiting at most `max_wait_ms`
+    for a batch to fill. Each caller gets its own vectors back.
+    """
+
+    def __init__(self, model, batch_size=32, max_wait_ms=10, workers=1):
+        self.model = model
+        self.batch_size = max(1, int(batch_size))
+        self.max_wait = max(0, int(max_wait_ms)) / 1000
+        self._queue = queue.Queue()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"embedding-batcher-{i}", daemon=True)
+            for i in range(max(1, int(workers)))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def embed(self, text):
+        """Embed a single text. Blocks until its batch has been processed."""
+        return self.embed_many([text])[0]
+
+    def embed_many(self, texts):
+        """Embed a list of texts, returning vectors in the same order."""
+        futures = []
+        for text in texts:
+            future = Future()
+            self._queue.put((text, future))
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def _next_batch(self):
+        # Block for the first request, then drain whatever arrives before the deadline
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            texts = [text for text, _ in batch]
+            try:
+                vectors = self.model.embed_documents(texts)
+                logger.debug(f"Embedded batch of {len(texts)} texts")
+            except Exception as e:
+                logger.error(f"Error embedding batch of {len(texts)} texts: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
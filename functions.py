@@ -1,13 +1,33 @@
-import os, logging, time, asyncio, requests
+import os, logging, time, asyncio, threading, hashlib, requests
 from google import genai
 
+from scratch import ScratchSpace, ScratchQuotaExceeded
+
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def detect_file_type(response):
-    """Detect file type from response headers or magic bytes."""
+# Streaming download limits
+MAX_DOWNLOAD_BYTES = int(os.environ.get("MAX_DOWNLOAD_MB", 200)) * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_RETRIES = int(os.environ.get("DOWNLOAD_RETRIES", 3))
+DOWNLOAD_TIMEOUT = int(os.environ.get("DOWNLOAD_TIMEOUT", 30))
+
+# Per-job scratch directories (tmpfs when available) with a shared disk quota
+scratch_space = ScratchSpace(
+    quota_bytes=int(os.environ.get("SCRATCH_QUOTA_MB", 2048)) * 1024 * 1024,
+    wait_timeout=int(os.environ.get("SCRATCH_WAIT_TIMEOUT", 60))
+)
+
+class DownloadError(Exception):
+    """Raised when a media download fails, exceeds MAX_DOWNLOAD_BYTES or cannot be resumed."""
+
+class FileTooLarge(DownloadError):
+    """Raised when the media is larger than MAX_DOWNLOAD_BYTES; retrying won't help."""
+
+def detect_file_type(content_type, content):
+    """Detect file type from the Content-Type header or the first bytes of the file."""
     # Check Content-Type header first
-    content_type = response.headers.get('content-type', '').lower()
+    content_type = (content_type or '').lower()
     
     if 'video' in content_type:
         return 'video', 'mp4'
@@ -15,7 +35,7 @@ def detect_file_type(response):
         return 'image', 'jpg'
     
     # Fall back to magic bytes detection
-    content = response.content[:12]
+    content = content[:12]
     
     # Video magic bytes
     if content.startswith(b'\x00\x00\x00\x18ftypisom'):  # MP4
@@ -39,73 +59,234 @@ def detect_file_type(response):
     logger.warning(f"Could not determine file type from Content-Type: {content_type}, magic bytes: {content.hex()[:20]}... - defaulting to mp4")
     return 'video', 'mp4'
 
-async def gemini(url, is_reel=True):
+def content_range_start(header):
+    """First byte offset of a `Content-Range: bytes <start>-<end>/<size>` header, or None if unparseable."""
+    unit, _, spec = (header or "").partition(" ")
+    start = spec.split("-", 1)[0]
+    return int(start) if unit.strip().lower() == "bytes" and start.isdigit() else None
+
+def download_file(url, path, max_bytes=MAX_DOWNLOAD_BYTES, retries=DOWNLOAD_RETRIES):
+    """
+    Stream `url` to `path` in DOWNLOAD_CHUNK_SIZE chunks so memory use stays constant.
+    Dropped connections are resumed with an HTTP Range request up to `retries` times.
+    Returns (file_type, extension, size_in_bytes, sha256_hexdigest).
+    """
+    written = 0
+    digest = hashlib.sha256()
+    head = b""
+    content_type = ""
+    attempt = 0
+    with open(path, 'wb') as f:
+        while True:
+            headers = {"Range": f"bytes={written}-"} if written else {}
+            try:
+                with requests.get(url, stream=True, headers=headers, timeout=DOWNLOAD_TIMEOUT) as response:
+                    resumed_at = content_range_start(response.headers.get('content-range')) if response.status_code == 206 else None
+                    if written and resumed_at != written:
+                        # Server ignored the Range header or sent a different range: appending would corrupt the file
+                        logger.warning(f"Cannot resume at byte {written} (HTTP {response.status_code}, Content-Range {response.headers.get('content-range')}), restarting download")
+                        f.seek(0)
+                        f.truncate()
+                        written = 0
+                        digest = hashlib.sha256()
+                        head = b""
+                        if response.status_code == 206:
+                            # This partial body doesn't start at byte 0 either; request the whole file again
+                            continue
+                    if response.status_code not in (200, 206):
+                        raise DownloadError(f"Failed to download file: HTTP {response.status_code}")
+
+                    content_type = content_type or response.headers.get('content-type', '')
+                    content_length = response.headers.get('content-length')
+                    if content_length and content_length.isdigit() and written + int(content_length) > max_bytes:
+                        raise FileTooLarge(f"File too large: {written + int(content_length)} bytes (max {max_bytes})")
+
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        if not chunk:
+                            continue
+                        if len(head) < 12:
+                            head += chunk[:12 - len(head)]
+                        written += len(chunk)
+                        if written > max_bytes:
+                            raise FileTooLarge(f"File too large: more than {max_bytes} bytes")
+                        digest.update(chunk)
+                        f.write(chunk)
+                break
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                attempt += 1
+                if attempt > retries:
+                    raise DownloadError(f"Download failed after {retries} retries: {e}") from e
+                logger.warning(f"Download interrupted at {written} bytes ({e}), resuming (attempt {attempt}/{retries})")
+
+    file_type, extension = detect_file_type(content_type, head)
+    return file_type, extension, written, digest.hexdigest()
+
+# Pipeline stage limits. Waiting on Gemini processing is cheap (no threads), so it gets a much larger bound.
+GEMINI_STAGE_LIMITS = {
+    "download": int(os.environ.get("GEMINI_DOWNLOAD_CONCURRENCY", 10)),
+    "upload": int(os.environ.get("GEMINI_UPLOAD_CONCURRENCY", 10)),
+    "processing": int(os.environ.get("GEMINI_PROCESSING_CONCURRENCY", 500)),
+    "generate": int(os.environ.get("GEMINI_GENERATE_CONCURRENCY", 10)),
+}
+GEMINI_POLL_INITIAL = float(os.environ.get("GEMINI_POLL_INITIAL", 0.5))
+GEMINI_POLL_MAX = float(os.environ.get("GEMINI_POLL_MAX", 10))
+GEMINI_PROCESSING_TIMEOUT = float(os.environ.get("GEMINI_PROCESSING_TIMEOUT", 300))
+GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-2.0-flash")
+
+def make_stages():
+    """Create one semaphore per pipeline stage. Must be called on the loop that will use them."""
+    return {name: asyncio.Semaphore(limit) for name, limit in GEMINI_STAGE_LIMITS.items()}
+
+class GeminiWorker:
+    """
+    Long-lived Gemini runner: one genai.Client and one event loop on a background thread,
+    shared by every job. Use `submit()` from worker threads or `await run()` on the loop.
+    """
+
+    def __init__(self, api_key=None):
+        self.api_key = api_key
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._stages = None
+        self.caption_cache = None  # Optional store with get(key)/set(keys, caption), see cache.CaptionCache
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="gemini-loop", daemon=True)
+        self._thread.start()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = genai.Client(api_key=self.api_key or os.environ.get("GEMINI_API_KEY"))
+        return self._client
+
+    @property
+    def loop(self):
+        return self._loop
+
+    async def run(self, url, is_reel=True, media_key=None):
+        """Awaitable entry point; must be awaited on the worker's loop."""
+        if self._stages is None:
+            self._stages = make_stages()
+        return await gemini(url, is_reel, client=self.client, stages=self._stages, caption_cache=self.caption_cache, media_key=media_key)
+
+    def submit(self, url, is_reel=True, media_key=None):
+        """Schedule a job on the shared loop and return a concurrent.futures.Future for its caption."""
+        return asyncio.run_coroutine_threadsafe(self.run(url, is_reel, media_key), self._loop)
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+gemini_worker = GeminiWorker()
+
+async def gemini(url, is_reel=True, client=None, stages=None, caption_cache=None, media_key=None):
+    """
+    Caption a reel: download -> upload -> wait for processing -> generate.
+    Each stage is bounded by its own semaphore; only the download runs in a thread.
+    With a `caption_cache`, captions are reused by `media_key` (the Instagram media id)
+    or, failing that, by the sha256 of the downloaded bytes.
+    Download (DownloadError, FileTooLarge), scratch quota and Gemini errors raise.
+    """
     if url == "":
         return ""
+    client = client or gemini_worker.client
+    stages = stages or make_stages()
 
-    logger.debug(f"Downloading file from: {url}")
+    # Same reel already captioned, possibly for another user
+    if caption_cache and media_key:
+        cached = await asyncio.to_thread(caption_cache.get, media_key)
+        if cached:
+            logger.info(f"Caption cache hit for {media_key}")
+            return cached
 
-    # Download the file
-    response = requests.get(url)
-    if response.status_code != 200:
-        logger.error(f"Failed to download file: {response.status_code}")
-        return ""
-    
-    # Detect file type
-    file_type, extension = detect_file_type(response)
-    filename = f"temp_video.{extension}" if file_type == 'video' else f"temp_image.{extension}"
-    
-    logger.info(f"Detected {file_type} file ({extension}): {filename}")
-    
-    # Save the file
-    try:
-        with open(filename, 'wb') as f:
-            f.write(response.content)
-        logger.debug(f"File downloaded and saved: {filename} ({len(response.content)} bytes)")
-    except Exception as e:
-        logger.error(f"Failed to save file: {e}")
-        return ""
+    uploaded, content_key, cached = await _download_and_upload(url, client, stages, caption_cache)
+    if cached:
+        logger.info(f"Caption cache hit for {content_key}")
+        if media_key:
+            await asyncio.to_thread(caption_cache.set, [media_key], cached)
+        return cached
+
+    async with stages["processing"]:
+        uploaded = await _wait_until_processed(client, uploaded)
 
-    # Create a new event loop
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    async with stages["generate"]:
+        caption = await _generate_caption(client, uploaded)
 
-    client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+    if caption and caption_cache:
+        await asyncio.to_thread(caption_cache.set, [key for key in (media_key, content_key) if key], caption)
+    return caption
 
-    logger.debug("Uploading file to Gemini...")
+async def _download_and_upload(url, client, stages, caption_cache=None):
+    """
+    Stream the media into a scratch directory and upload it. Scratch space is released once uploaded.
+    Returns (uploaded_file, content_key, cached_caption); the upload is skipped on a content cache hit.
+    Raises DownloadError, ScratchQuotaExceeded or the upload error.
+    """
     try:
-        video_file = client.files.upload(file=filename)
-        logger.debug(f"Completed upload: {video_file.uri}")
-    except Exception as e:
-        logger.error(f"Failed to upload file: {e}")
-        try:
-            os.remove(filename)
-        except:
-            pass
-        return ""
+        async with scratch_space.ajob(MAX_DOWNLOAD_BYTES) as job:
+            logger.debug(f"Downloading file from: {url}")
+            download_path = job.path("media.download")
+            async with stages["download"]:
+                try:
+                    file_type, extension, size, sha256 = await asyncio.to_thread(download_file, url, download_path, max_bytes=job.reserved_bytes)
+                except Exception as e:
+                    logger.error(f"Failed to download file: {e}")
+                    raise
+
+            content_key = f"sha256:{sha256}"
+            if caption_cache:
+                cached = await asyncio.to_thread(caption_cache.get, content_key)
+                if cached:
+                    return None, content_key, cached
+
+            # Give the file the detected extension so the upload gets the right mime type
+            filename = job.path(f"temp_{file_type}.{extension}")
+            os.replace(download_path, filename)
+            logger.info(f"Detected {file_type} file ({extension}): {filename}")
+            logger.debug(f"File downloaded and saved: {filename} ({size} bytes)")
+
+            logger.debug("Uploading file to Gemini...")
+            async with stages["upload"]:
+                try:
+                    video_file = await client.aio.files.upload(file=filename)
+                    logger.debug(f"Completed upload: {video_file.uri}")
+                    return video_file, content_key, None
+                except Exception as e:
+                    logger.error(f"Failed to upload file: {e}")
+                    raise
+    except ScratchQuotaExceeded as e:
+        logger.error(f"No scratch space for {url}: {e}")
+        raise
 
-    # Wait until the file is processed
+async def _wait_until_processed(client, video_file):
+    """Poll the uploaded file with exponential backoff until Gemini finishes processing it."""
+    delay = GEMINI_POLL_INITIAL
+    deadline = time.monotonic() + GEMINI_PROCESSING_TIMEOUT
     while video_file.state.name == "PROCESSING":
-        print('.', end='', flush=True)
-        await asyncio.sleep(1)
-        video_file = client.files.get(name=video_file.name)
+        if time.monotonic() > deadline:
+            logger.error(f"File processing timed out after {GEMINI_PROCESSING_TIMEOUT}s: {video_file.name}")
+            raise TimeoutError(video_file.name)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, GEMINI_POLL_MAX)
+        video_file = await client.aio.files.get(name=video_file.name)
 
     if video_file.state.name == "FAILED":
         logger.error(f"File processing failed: {video_file.state.name}")
-        try:
-            os.remove(filename)
-        except:
-            pass
         raise ValueError(video_file.state.name)
 
     logger.debug('File processed successfully')
+    return video_file
 
+async def _generate_caption(client, video_file):
     # Generate content from the file
     prompt = os.environ.get("GEMINI_PROMPT", "With simple texts only and no `here you go...` or `following is:...` types of statements, for each scene in this video, generate captions that describe the scene along with any spoken text placed in quotation marks without timestamp. Provide your explanation. Only respond with what is asked. \nExample: A guy tasting something spicy and can't control his emotions and tears up.")
     
     try:
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
+        response = await client.aio.models.generate_content(
+            model=GEMINI_MODEL,
             contents=[
                 video_file,
                 prompt
@@ -113,17 +294,6 @@ async def gemini(url, is_reel=True):
         )
     except Exception as e:
         logger.error(f"Failed to generate content: {e}")
-        try:
-            os.remove(filename)
-        except:
-            pass
-        return ""
-
-    # Clean up temp file
-    try:
-        os.remove(filename)
-        logger.debug(f"Temp file deleted: {filename}")
-    except Exception as e:
-        logger.warning(f"Failed to delete temp file: {e}")
+        raise
 
-    return response.text
\ No newline at end of file
+    return response.text
@@ -0,0 +1,95 @@
+import os, logging, time, requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+logger = logging.getLogger(__name__)
+
+GRAPH_API_URL = "https://graph.instagram.com/v22.0"
+
+# Graph API error codes that mean "throttled", returned with HTTP 400/403 rather than 429
+RATE_LIMIT_ERROR_CODES = {4, 17, 32, 613}
+# Methods that are safe to repeat after the server may already have acted on them
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+class GraphAPIClient:
+    """
+    Shared client for Instagram Graph API calls.
+    Keeps one pooled keep-alive `requests.Session`, applies a default timeout and retries with
+    exponential backoff (honouring Retry-After, capped at `max_retry_after` seconds):
+    - every request: failures to connect, 429 and Graph rate-limit errors, which mean the
+      request was never acted on;
+    - GET only: read timeouts and 5xx. A POST that timed out or got a 5xx may still have been
+      delivered, and sending it again would duplicate the message.
+    Returns the final `requests.Response`; connection errors are re-raised after the last attempt.
+    """
+
+    def __init__(self, pool_size=10, timeout=(5, 30), max_retries=3, backoff=0.5, max_retry_after=60):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_retry_after = max_retry_after
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _should_retry(self, method, response):
+        if response.status_code == 429:
+            return True
+        if response.status_code >= 500:
+            return method in IDEMPOTENT_METHODS
+        if response.status_code in (400, 403):
+            try:
+                code = response.json().get("error", {}).get("code")
+            except ValueError:
+                return False
+            return code in RATE_LIMIT_ERROR_CODES
+        return False
+
+    def _retry_delay(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(int(retry_after), self.max_retry_after)
+        return self.backoff * (2 ** attempt)
+
+    @staticmethod
+    def _not_sent(error):
+        """Whether a request failed before a connection was made, so the server never saw it."""
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        return isinstance(reason, NewConnectionError)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        method = method.upper()
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries or not (method in IDEMPOTENT_METHODS or self._not_sent(e)):
+                    raise
+                delay = self._retry_delay(attempt)
+                logger.warning(f"Graph API {method} failed ({e}), retrying in {delay:.1f}s ({attempt + 1}/{self.max_retries})")
+            else:
+                if not self._should_retry(method, response) or attempt >= self.max_retries:
+                    return response
+                delay = self._retry_delay(attempt, response)
+                logger.warning(f"Graph API {method} returned HTTP {response.status_code}, retrying in {delay:.1f}s ({attempt + 1}/{self.max_retries})")
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+# Pool sized to the number of executor workers that send messages concurrently
+graph = GraphAPIClient(
+    pool_size=int(os.environ.get("GRAPH_POOL_SIZE", os.environ.get("EXECUTOR_WORKERS", 10))),
+    timeout=(float(os.environ.get("GRAPH_CONNECT_TIMEOUT", 5)), float(os.environ.get("GRAPH_READ_TIMEOUT", 30))),
+    max_retries=int(os.environ.get("GRAPH_MAX_RETRIES", 3)),
+    max_retry_after=int(os.environ.get("GRAPH_MAX_RETRY_AFTER", 60))
+)
@@ -0,0 +1,66 @@
+import logging, math, re, zlib
+from collections import Counter
+from qdrant_client.http.models import SparseVector
+
+logger = logging.getLogger(__name__)
+
+# Name of the sparse (keyword) vector stored next to the unnamed dense MiniLM vector
+SPARSE_VECTOR_NAME = "bm25"
+
+# BM25 term-frequency saturation and length normalization. Qdrant applies IDF at query
+# time (sparse vector modifier "idf"), so document weights only carry the TF part.
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Typical caption/description length in tokens, used in place of a corpus-wide average
+BM25_AVG_LENGTH = 40
+
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have he her his i in is it its me my of on or our she so
+that the their them they this to was we were what when where which who will with you your
+""".split())
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+def tokenize(text):
+    """Lowercased word tokens without stopwords. Names, numbers and hashtags survive as-is."""
+    return [token for token in TOKEN_PATTERN.findall((text or "").lower()) if token not in STOPWORDS]
+
+def token_index(token):
+    """Stable sparse dimension for a token (same in every process and collection)."""
+    return zlib.crc32(token.encode("utf-8")) & 0x7fffffff
+
+def _sparse(weights):
+    indices = sorted(weights)
+    return SparseVector(indices=indices, values=[weights[i] for i in indices])
+
+def bm25_document_vector(text):
+    """BM25 TF weights for a stored caption/description."""
+    counts = Counter(token_index(token) for token in tokenize(text))
+    length = sum(counts.values())
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / BM25_AVG_LENGTH)
+    return _sparse({index: tf * (BM25_K1 + 1) / (tf + norm) for index, tf in counts.items()})
+
+def bm25_query_vector(text):
+    """Query side: each distinct term counts once; Qdrant multiplies in the IDF."""
+    return _sparse({token_index(token): 1.0 for token in set(tokenize(text))})
+
+class CrossEncoderReranker:
+    """
+    Re-scores (query, text) pairs with a small sentence-transformers cross-encoder on CPU,
+    e.g. cross-encoder/ms-marco-MiniLM-L-6-v2. Used over the fused top-k only.
+    """
+
+    def __init__(self, model_name, batch_size=32):
+        from sentence_transformers import CrossEncoder
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.model = CrossEncoder(model_name, device="cpu")
+
+    def rerank(self, query, points, text_key="message"):
+        """Return `points` sorted by cross-encoder score, with `score` replaced by it."""
+        if not points:
+            return points
+        scores = self.model.predict([(query, (point.payload or {}).get(text_key) or "") for point in points], batch_size=self.batch_size)
+        for point, score in zip(points, scores):
+            # Logit to 0..1 so score thresholds stay comparable across queries
+            point.score = 1 / (1 + math.exp(-float(score)))
+        return sorted(points, key=lambda point: point.score, reverse=True)
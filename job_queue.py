@@ -0,0 +1,224 @@
+import os, logging, socket, threading, time
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from pymongo import ASCENDING, ReturnDocument
+
+from mongo_schema import ensure_ttl_index
+
+logger = logging.getLogger(__name__)
+
+PENDING, RUNNING, DONE, DEAD = "pending", "running", "done", "dead"
+
+class QueueFull(Exception):
+    """Raised by `enqueue` when a job type already has `max_pending` jobs waiting."""
+
+def _now():
+    return datetime.now(timezone.utc)
+
+class JobQueue:
+    """
+    Durable job queue stored in a Mongo collection.
+    Jobs are claimed atomically with `find_one_and_update` and leased for `visibility_timeout`
+    seconds; a job whose lease expires (crashed worker, restart) becomes claimable again.
+    Failed jobs are retried with exponential backoff and moved to the `dead` state after
+    `max_attempts`, after which `on_dead(job, error)` is called (e.g. to tell the user).
+    Finished jobs are removed `done_ttl` seconds after completion.
+    Jobs enqueued with `order_keys` run in creation order per key, across job types: a job is
+    only claimed once no earlier pending or running job shares one of its keys; a blocked job
+    is put back for `order_delay` seconds without using an attempt.
+    """
+
+    def __init__(self, collection, visibility_timeout=600, max_attempts=5, max_pending=None, retry_backoff=30, done_ttl=24 * 60 * 60, on_dead=None, order_delay=1):
+        self.collection = collection
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.max_pending = max_pending
+        self.retry_backoff = retry_backoff
+        self.done_ttl = done_ttl
+        self.on_dead = on_dead
+        self.order_delay = order_delay
+
+    def ensure_indexes(self):
+        self.collection.create_index([("type", ASCENDING), ("status", ASCENDING), ("available_at", ASCENDING)])
+        self.collection.create_index([("type", ASCENDING), ("status", ASCENDING), ("lease_expires_at", ASCENDING)])
+        ensure_ttl_index(self.collection, "done_at", self.done_ttl)
+        self.collection.create_index([("order_keys", ASCENDING), ("created_at", ASCENDING)], sparse=True)
+
+    def enqueue(self, job_type, payload, order_keys=None):
+        """Persist a job and return its id. Raises QueueFull when the type's backlog is at `max_pending`."""
+        if self.max_pending and self.collection.count_documents({"type": job_type, "status": PENDING}, limit=self.max_pending) >= self.max_pending:
+            raise QueueFull(f"{job_type} queue has {self.max_pending} pending jobs")
+        now = _now()
+        job = {
+            "type": job_type,
+            "payload": payload,
+            "status": PENDING,
+            "attempts": 0,
+            "created_at": now,
+            "available_at": now
+        }
+        if order_keys:
+            job["order_keys"] = list(order_keys)
+        return self.collection.insert_one(job).inserted_id
+
+    def claim(self, job_type, worker_id):
+        """Atomically lease the next available job of `job_type`, or return None."""
+        while True:
+            now = _now()
+            job = self.collection.find_one_and_update(
+                {"type": job_type, "$or": [
+                    {"status": PENDING, "available_at": {"$lte": now}},
+                    {"status": RUNNING, "lease_expires_at": {"$lte": now}}
+                ]},
+                {"$set": {"status": RUNNING, "worker": worker_id, "lease_expires_at": now + timedelta(seconds=self.visibility_timeout)},
+                 "$inc": {"attempts": 1}},
+                sort=[("available_at", ASCENDING)],
+                return_document=ReturnDocument.AFTER
+            )
+            if job is not None and job.get("order_keys") and self._has_earlier(job):
+                # An earlier job for the same key hasn't finished; try again after order_delay
+                self.collection.update_one(
+                    {"_id": job["_id"], "worker": worker_id},
+                    {"$set": {"status": PENDING, "available_at": now + timedelta(seconds=self.order_delay)},
+                     "$inc": {"attempts": -1}, "$unset": {"lease_expires_at": ""}}
+                )
+                continue
+            if job is None or job["attempts"] <= self.max_attempts:
+                return job
+            # Lease expired on its last attempt (worker kept crashing on it)
+            self._dead_letter(job, job.get("last_error") or "lease expired on final attempt")
+
+    def _has_earlier(self, job):
+        """Whether a job created before `job` that shares one of its order keys is still pending or running."""
+        return self.collection.count_documents({
+            "order_keys": {"$in": job["order_keys"]},
+            "status": {"$in": [PENDING, RUNNING]},
+            "$or": [
+                {"created_at": {"$lt": job["created_at"]}},
+                {"created_at": job["created_at"], "_id": {"$lt": job["_id"]}}
+            ]
+        }, limit=1) > 0
+
+    def renew(self, job):
+        """Extend the lease of a job this worker still holds. Returns False if the lease was lost."""
+        result = self.collection.update_one(
+            {"_id": job["_id"], "worker": job["worker"], "status": RUNNING},
+            {"$set": {"lease_expires_at": _now() + timedelta(seconds=self.visibility_timeout)}}
+        )
+        return result.modified_count == 1
+
+    def complete(self, job):
+        self.collection.update_one({"_id": job["_id"], "worker": job["worker"]}, {"$set": {"status": DONE, "done_at": _now()}, "$unset": {"lease_expires_at": ""}})
+
+    def fail(self, job, error):
+        """Schedule a retry with backoff, or dead-letter the job once it has used all attempts."""
+        if job["attempts"] >= self.max_attempts:
+            self._dead_letter(job, error)
+            return
+        delay = self.retry_backoff * (2 ** (job["attempts"] - 1))
+        self.collection.update_one(
+            {"_id": job["_id"], "worker": job["worker"]},
+            {"$set": {"status": PENDING, "available_at": _now() + timedelta(seconds=delay), "last_error": str(error)}, "$unset": {"lease_expires_at": ""}}
+        )
+        logger.warning(f"Job {job['_id']} ({job['type']}) failed, retrying in {delay}s: {error}")
+
+    def _dead_letter(self, job, error):
+        self.collection.update_one({"_id": job["_id"]}, {"$set": {"status": DEAD, "last_error": str(error), "dead_at": _now()}, "$unset": {"lease_expires_at": ""}})
+        logger.error(f"Job {job['_id']} ({job['type']}) moved to dead-letter after {job['attempts']} attempts: {error}")
+        if self.on_dead:
+            try:
+                self.on_dead(job, error)
+            except Exception as e:
+                logger.error(f"Error in dead-letter callback for job {job['_id']}: {e}")
+
+    def status(self, job_id):
+        """Current status of a job (`job_id` as ObjectId or string), or None once it has expired or never existed."""
+        job = self.collection.find_one({"_id": ObjectId(job_id)}, {"status": 1})
+        return job["status"] if job else None
+
+    def stats(self):
+        counts = {}
+        for row in self.collection.aggregate([{"$group": {"_id": {"type": "$type", "status": "$status"}, "count": {"$sum": 1}}}]):
+            counts.setdefault(row["_id"]["type"], {})[row["_id"]["status"]] = row["count"]
+        return counts
+
+class JobWorker:
+    """
+    Pulls jobs of one type from a JobQueue and runs `handler(**payload)` on `executor`,
+    with at most `concurrency` jobs in flight. A handler may return a concurrent Future,
+    in which case the job stays leased (and counts against concurrency) until it resolves.
+    Leases of in-flight jobs are renewed every third of the visibility timeout, so a long
+    job isn't claimed (and run twice) by another worker while this one is still on it.
+    """
+
+    def __init__(self, queue, job_type, handler, executor, concurrency=4, poll_interval=1.0):
+        self.queue = queue
+        self.job_type = job_type
+        self.handler = handler
+        self.executor = executor
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{job_type}"
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f"job-worker-{job_type}", daemon=True)
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat, name=f"job-heartbeat-{job_type}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self._heartbeat_thread.start()
+        return self
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(max(1.0, self.queue.visibility_timeout / 3))
+            with self._in_flight_lock:
+                jobs = list(self._in_flight.values())
+            for job in jobs:
+                try:
+                    if not self.queue.renew(job):
+                        logger.warning(f"Lost the lease on {self.job_type} job {job['_id']}")
+                except Exception as e:
+                    logger.error(f"Error renewing {self.job_type} job {job['_id']}: {e}")
+
+    def _run(self):
+        while True:
+            self._slots.acquire()
+            try:
+                job = self.queue.claim(self.job_type, self.worker_id)
+            except Exception as e:
+                logger.error(f"Error claiming {self.job_type} job: {e}")
+                job = None
+            if job is None:
+                self._slots.release()
+                time.sleep(self.poll_interval)
+                continue
+            with self._in_flight_lock:
+                self._in_flight[job["_id"]] = job
+            self.executor.submit(self._execute, job)
+
+    def _execute(self, job):
+        try:
+            result = self.handler(**job["payload"])
+        except Exception as e:
+            logger.exception(f"Error running {self.job_type} job {job['_id']}: {e}")
+            self._finish(job, e)
+            return
+        if isinstance(result, Future):
+            result.add_done_callback(lambda future: self._finish(job, future.exception()))
+        else:
+            self._finish(job, None)
+
+    def _finish(self, job, error):
+        with self._in_flight_lock:
+            self._in_flight.pop(job["_id"], None)
+        try:
+            if error is None:
+                self.queue.complete(job)
+            else:
+                self.queue.fail(job, error)
+        except Exception as e:
+            logger.error(f"Error updating {self.job_type} job {job['_id']}: {e}")
+        finally:
+            self._slots.release()
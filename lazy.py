@@ -0,0 +1,64 @@
+import logging, threading, time
+
+logger = logging.getLogger(__name__)
+
+class LazyResource:
+    """
+    Thread-safe lazily created value. `factory` runs once, on the first `get()` (or `warm_up()`);
+    concurrent callers wait for that single initialization. A failed initialization is retried
+    on the next `get()`.
+    """
+
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.load_seconds = None
+        self.error = None
+        self._value = None
+        self._ready = False
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self._ready
+
+    def get(self):
+        if self._ready:
+            return self._value
+        with self._lock:
+            if not self._ready:
+                started = time.perf_counter()
+                try:
+                    self._value = self.factory()
+                except Exception as e:
+                    self.error = str(e)
+                    logger.error(f"Failed to initialize {self.name}: {e}")
+                    raise
+                self.load_seconds = time.perf_counter() - started
+                self.error = None
+                self._ready = True
+                logger.info(f"Initialized {self.name} in {self.load_seconds:.2f}s")
+        return self._value
+
+    def warm_up(self):
+        """Initialize now, swallowing errors (they are reported by `status()`)."""
+        try:
+            self.get()
+        except Exception:
+            pass
+
+    def status(self):
+        return {
+            "ready": self._ready,
+            "load_seconds": round(self.load_seconds, 3) if self.load_seconds is not None else None,
+            "error": self.error
+        }
+
+def warm_up_in_background(resources):
+    """Initialize `resources` one after another on a daemon thread."""
+    def run():
+        for resource in resources:
+            resource.warm_up()
+    thread = threading.Thread(target=run, name="warm-up", daemon=True)
+    thread.start()
+    return thread
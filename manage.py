@@ -0,0 +1,159 @@
+"""
+Maintenance commands for reel-finder.
+
+Usage:
+    python manage.py backfill-indexes
+    python manage.py compact [--collection ID] [--dry-run]
+    python manage.py migrate-shared [--target reels] [--delete-source]
+    python manage.py enable-hybrid [--collection ID]
+    python manage.py apply-vector-config [--collection ID]
+"""
+import argparse, logging, os
+from dotenv import load_dotenv
+from qdrant_client import QdrantClient
+
+from vector_store import ensure_payload_indexes, compact_collection, create_collection, migrate_to_shared, tenant_filter, rebuild_as_hybrid, apply_vector_config
+from vector_config import VectorConfig
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def get_qdrant_client():
+    return QdrantClient(url=os.environ.get("QDRANT_URL"), api_key=os.environ.get("QDRANT_API_KEY"))
+
+def shared_collection_name():
+    return os.environ.get("QDRANT_SHARED_COLLECTION", "reels")
+
+def backfill_indexes(args):
+    """One-time backfill: add the `mid`/`reel_id` keyword indexes to collections created before they existed."""
+    qdrant_client = get_qdrant_client()
+    collections = [c.name for c in qdrant_client.get_collections().collections]
+    logger.info(f"Backfilling payload indexes for {len(collections)} collections")
+
+    updated = 0
+    for collection_name in collections:
+        try:
+            if ensure_payload_indexes(qdrant_client, collection_name, shared=collection_name == shared_collection_name()):
+                updated += 1
+        except Exception as e:
+            logger.error(f"Failed to index collection {collection_name}: {e}")
+    logger.info(f"Done. Added indexes to {updated}/{len(collections)} collections")
+
+def compact(args):
+    """Merge duplicate points (same source message and text) in each per-user collection."""
+    qdrant_client = get_qdrant_client()
+    collections = [args.collection] if args.collection else [c.name for c in qdrant_client.get_collections().collections]
+    logger.info(f"Compacting {len(collections)} collections{' (dry run)' if args.dry_run else ''}")
+
+    total_scanned = total_removed = 0
+    for collection_name in collections:
+        try:
+            scanned, removed = compact_collection(qdrant_client, collection_name, dry_run=args.dry_run)
+        except Exception as e:
+            logger.error(f"Failed to compact collection {collection_name}: {e}")
+            continue
+        total_scanned += scanned
+        total_removed += removed
+    logger.info(f"Done. {'Would remove' if args.dry_run else 'Removed'} {total_removed}/{total_scanned} points")
+
+def migrate_shared(args):
+    """
+    Move every per-user collection into the shared multi-tenant collection. Safe to re-run;
+    sources are only deleted with --delete-source, after their point count is verified.
+    Set QDRANT_LAYOUT=shared on the app once this has finished.
+    """
+    qdrant_client = get_qdrant_client()
+    target = args.target or shared_collection_name()
+    if not qdrant_client.collection_exists(target):
+        create_collection(qdrant_client, target, shared=True)
+    sources = [c.name for c in qdrant_client.get_collections().collections if c.name != target]
+    logger.info(f"Migrating {len(sources)} collections into {target}")
+
+    migrated = 0
+    for collection_name in sources:
+        try:
+            copied = migrate_to_shared(qdrant_client, collection_name, target, batch_size=args.batch_size)
+            if args.delete_source:
+                in_target = qdrant_client.count(target, count_filter=tenant_filter(collection_name), exact=True).count
+                if in_target < copied:
+                    logger.error(f"Keeping {collection_name}: {in_target}/{copied} points found in {target}")
+                    continue
+                qdrant_client.delete_collection(collection_name)
+                logger.info(f"Deleted {collection_name}")
+            migrated += 1
+        except Exception as e:
+            logger.error(f"Failed to migrate collection {collection_name}: {e}")
+    logger.info(f"Done. Migrated {migrated}/{len(sources)} collections")
+
+def enable_hybrid(args):
+    """
+    Add the BM25 sparse vector to collections created before SEARCH_MODE=hybrid. Qdrant can't
+    add a vector to an existing collection, so each one is rebuilt; stop the workers first.
+    """
+    qdrant_client = get_qdrant_client()
+    names = [c.name for c in qdrant_client.get_collections().collections]
+    # A staging collection left by an interrupted run stands for its original
+    collections = [args.collection] if args.collection else sorted({name.removesuffix("__hybrid") for name in names})
+    logger.info(f"Enabling hybrid search on {len(collections)} collections")
+
+    rebuilt = 0
+    for collection_name in collections:
+        try:
+            if rebuild_as_hybrid(qdrant_client, collection_name, shared=collection_name == shared_collection_name(), batch_size=args.batch_size):
+                rebuilt += 1
+        except Exception as e:
+            logger.error(f"Failed to rebuild collection {collection_name}: {e}")
+    logger.info(f"Done. Rebuilt {rebuilt}/{len(collections)} collections")
+
+def apply_config(args):
+    """
+    Apply the QDRANT_QUANTIZATION / QDRANT_ON_DISK_* / QDRANT_HNSW_* settings to existing
+    collections. Updates happen in place; Qdrant rebuilds quantized vectors and indexes in
+    the background (collection status is yellow until it is done).
+    """
+    qdrant_client = get_qdrant_client()
+    config = VectorConfig.from_env()
+    collections = [args.collection] if args.collection else [c.name for c in qdrant_client.get_collections().collections]
+    logger.info(f"Applying {config.describe()} to {len(collections)} collections")
+
+    updated = 0
+    for collection_name in collections:
+        try:
+            apply_vector_config(qdrant_client, collection_name, config)
+            updated += 1
+        except Exception as e:
+            logger.error(f"Failed to update collection {collection_name}: {e}")
+    logger.info(f"Done. Updated {updated}/{len(collections)} collections")
+
+def main():
+    load_dotenv(override=True)
+    parser = argparse.ArgumentParser(description="reel-finder maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("backfill-indexes", help="Add mid/reel_id payload indexes to existing Qdrant collections").set_defaults(func=backfill_indexes)
+
+    compact_parser = subparsers.add_parser("compact", help="Merge duplicate points in per-user Qdrant collections")
+    compact_parser.add_argument("--collection", help="Only compact this collection (sender id)")
+    compact_parser.add_argument("--dry-run", action="store_true", help="Report duplicates without changing anything")
+    compact_parser.set_defaults(func=compact)
+
+    migrate_parser = subparsers.add_parser("migrate-shared", help="Move per-user collections into the shared multi-tenant collection")
+    migrate_parser.add_argument("--target", help="Shared collection name (default QDRANT_SHARED_COLLECTION or 'reels')")
+    migrate_parser.add_argument("--batch-size", type=int, default=256)
+    migrate_parser.add_argument("--delete-source", action="store_true", help="Delete each per-user collection once it is copied")
+    migrate_parser.set_defaults(func=migrate_shared)
+
+    hybrid_parser = subparsers.add_parser("enable-hybrid", help="Rebuild collections with the BM25 sparse vector for hybrid search")
+    hybrid_parser.add_argument("--collection", help="Only rebuild this collection")
+    hybrid_parser.add_argument("--batch-size", type=int, default=256)
+    hybrid_parser.set_defaults(func=enable_hybrid)
+
+    config_parser = subparsers.add_parser("apply-vector-config", help="Apply quantization/on-disk/HNSW settings from the environment to existing collections")
+    config_parser.add_argument("--collection", help="Only update this collection")
+    config_parser.set_defaults(func=apply_config)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
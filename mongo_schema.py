@@ -0,0 +1,69 @@
+import logging
+from pymongo import ASCENDING, DESCENDING
+
+logger = logging.getLogger(__name__)
+
+def remove_duplicates(collection, field):
+    """
+    Delete all but the newest document for each value of `field` that occurs more than once,
+    so a unique index can be built on collections that predate it. Returns documents removed.
+    Documents without `field` are left alone.
+    """
+    removed = 0
+    duplicates = collection.aggregate([
+        {"$match": {field: {"$exists": True}}},
+        {"$sort": {"_id": DESCENDING}},
+        {"$group": {"_id": f"${field}", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ], allowDiskUse=True)
+    for group in duplicates:
+        removed += collection.delete_many({"_id": {"$in": group["ids"][1:]}}).deleted_count
+    if removed:
+        logger.info(f"Removed {removed} duplicate '{field}' documents from {collection.name}")
+    return removed
+
+def ensure_unique_index(collection, field):
+    """Unique index on `field`. Existing duplicates are removed only when the index still has to be built."""
+    for index in collection.list_indexes():
+        if list(index["key"].keys()) == [field] and index.get("unique"):
+            return
+    remove_duplicates(collection, field)
+    collection.create_index([(field, ASCENDING)], unique=True)
+
+def ensure_ttl_index(collection, field, seconds):
+    """
+    TTL index expiring documents `seconds` after their `field` date. An existing TTL index
+    on the field is updated in place (collMod) when the window changes.
+    """
+    for index in collection.list_indexes():
+        if list(index["key"].keys()) == [field] and "expireAfterSeconds" in index:
+            if index["expireAfterSeconds"] != seconds:
+                collection.database.command("collMod", collection.name, index={"keyPattern": {field: 1}, "expireAfterSeconds": seconds})
+                logger.info(f"Changed TTL on {collection.name}.{field} to {seconds}s")
+            return
+    collection.create_index([(field, ASCENDING)], expireAfterSeconds=seconds)
+
+def backfill_date(collection, field, millis_field):
+    """Set the `field` date from an epoch-milliseconds field on documents written before `field` existed."""
+    result = collection.update_many(
+        {field: {"$exists": False}, millis_field: {"$type": "number"}},
+        [{"$set": {field: {"$toDate": f"${millis_field}"}}}]
+    )
+    if result.modified_count:
+        logger.info(f"Backfilled {field} on {result.modified_count} {collection.name} documents")
+
+def ensure_message_indexes(processed, users, processed_ttl, pending_ttl):
+    """
+    Indexes for webhook processing:
+    - processed_mids: unique `mid`, expiring `processed_ttl` seconds after `processed_at`
+      (Instagram stops redelivering a webhook well before then).
+    - users (reels waiting for a description): unique `sender_id`, expiring `pending_ttl`
+      seconds after `created_at`.
+    TTL needs a date, so older documents get one from their `timestamp`/`created_time` millis.
+    """
+    ensure_unique_index(processed, "mid")
+    backfill_date(processed, "processed_at", "timestamp")
+    ensure_ttl_index(processed, "processed_at", processed_ttl)
+    ensure_unique_index(users, "sender_id")
+    backfill_date(users, "created_at", "created_time")
+    ensure_ttl_index(users, "created_at", pending_ttl)
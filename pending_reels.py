@@ -0,0 +1,52 @@
+import logging
+from datetime import datetime, timezone
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+class PendingReels:
+    """
+    Reels waiting for a text description, at most one per sender (the `users` collection,
+    unique on `sender_id`, expired by its TTL index). Every step is a single atomic operation:
+    - `put` replaces the sender's pending reel with an upsert,
+    - `claim` marks it as taken by one description message, so a concurrent second
+      description finds nothing and the reel is described once,
+    - `complete` deletes it after the description is stored, or `release` hands it back
+      when storing failed so a retry can claim it again.
+    Descriptions are routed to the description job without a lookup; its `claim` is the
+    single round trip that finds the reel.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def put(self, sender_id, reel, created_time=None):
+        """Make `reel` the sender's pending reel, replacing (and unclaiming) any previous one."""
+        created_at = datetime.fromtimestamp(created_time / 1000, timezone.utc) if created_time else datetime.now(timezone.utc)
+        return self.collection.find_one_and_update(
+            {"sender_id": sender_id},
+            {"$set": {**reel, "sender_id": sender_id, "created_time": created_time, "created_at": created_at},
+             "$unset": {"claimed_by": ""}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+    def claim(self, sender_id, description_mid):
+        """
+        Atomically reserve the sender's pending reel for one description message and return it,
+        or None if there is none or another description already has it. Claiming again with the
+        same `description_mid` (a retried job) returns the same reel.
+        """
+        return self.collection.find_one_and_update(
+            {"sender_id": sender_id, "$or": [{"claimed_by": {"$exists": False}}, {"claimed_by": description_mid}]},
+            {"$set": {"claimed_by": description_mid}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    def complete(self, sender_id, description_mid):
+        """Remove the reel once its description is stored. No-op if a newer reel replaced it."""
+        return self.collection.find_one_and_delete({"sender_id": sender_id, "claimed_by": description_mid})
+
+    def release(self, sender_id, description_mid):
+        """Give a claimed reel back after its description failed to store."""
+        self.collection.update_one({"sender_id": sender_id, "claimed_by": description_mid}, {"$unset": {"claimed_by": ""}})
@@ -0,0 +1,113 @@
+import os, logging, shutil, tempfile, threading, time, uuid, asyncio
+from contextlib import contextmanager, asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+class ScratchQuotaExceeded(Exception):
+    """Raised when a job cannot reserve scratch space within the wait timeout."""
+
+def default_scratch_root(quota_bytes):
+    """Prefer tmpfs (/dev/shm) when it can hold the whole quota, otherwise the system temp dir."""
+    if os.environ.get("SCRATCH_DIR"):
+        return os.environ["SCRATCH_DIR"]
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) and shutil.disk_usage("/dev/shm").free >= quota_bytes:
+        return os.path.join("/dev/shm", "reelfinder")
+    return os.path.join(tempfile.gettempdir(), "reelfinder")
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class ScratchJob:
+    """Private directory for one job. Use `path(name)` to get file paths inside it."""
+
+    def __init__(self, directory, reserved_bytes):
+        self.directory = directory
+        self.reserved_bytes = reserved_bytes
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+class ScratchSpace:
+    """
+    Hands out a unique directory per job under `root` and removes it when the job ends.
+    Each job reserves `reserve_bytes` against `quota_bytes`; jobs wait up to `wait_timeout`
+    seconds for space and raise ScratchQuotaExceeded otherwise.
+    """
+
+    def __init__(self, root=None, quota_bytes=1024 * 1024 * 1024, wait_timeout=60):
+        self.root = root or default_scratch_root(quota_bytes)
+        self.quota_bytes = quota_bytes
+        self.wait_timeout = wait_timeout
+        self.reserved_bytes = 0
+        self._condition = threading.Condition()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _reserve(self, reserve_bytes):
+        reserve_bytes = min(reserve_bytes, self.quota_bytes)
+        deadline = time.monotonic() + self.wait_timeout
+        with self._condition:
+            while self.reserved_bytes + reserve_bytes > self.quota_bytes:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ScratchQuotaExceeded(f"Scratch quota exhausted ({self.reserved_bytes}/{self.quota_bytes} bytes reserved)")
+                self._condition.wait(remaining)
+            self.reserved_bytes += reserve_bytes
+        return reserve_bytes
+
+    def _release(self, reserve_bytes):
+        with self._condition:
+            self.reserved_bytes -= reserve_bytes
+            self._condition.notify_all()
+
+    def _new_directory(self):
+        directory = os.path.join(self.root, f"job-{os.getpid()}-{uuid.uuid4().hex}")
+        os.makedirs(directory)
+        return directory
+
+    @contextmanager
+    def job(self, reserve_bytes):
+        """Reserve space and yield a ScratchJob whose directory is deleted on exit."""
+        reserved = self._reserve(reserve_bytes)
+        directory = None
+        try:
+            directory = self._new_directory()
+            yield ScratchJob(directory, reserved)
+        finally:
+            if directory:
+                shutil.rmtree(directory, ignore_errors=True)
+            self._release(reserved)
+
+    @asynccontextmanager
+    async def ajob(self, reserve_bytes):
+        """Async variant of `job` that waits for quota without blocking the event loop."""
+        reserved = await asyncio.to_thread(self._reserve, reserve_bytes)
+        directory = None
+        try:
+            directory = self._new_directory()
+            yield ScratchJob(directory, reserved)
+        finally:
+            if directory:
+                await asyncio.to_thread(shutil.rmtree, directory, True)
+            self._release(reserved)
+
+    def sweep(self):
+        """Remove job directories left behind by processes that are no longer running. Call once at startup."""
+        removed = 0
+        for name in os.listdir(self.root):
+            parts = name.split("-")
+            if len(parts) != 3 or parts[0] != "job" or not parts[1].isdigit():
+                continue
+            pid = int(parts[1])
+            if pid != os.getpid() and _pid_alive(pid):
+                continue
+            shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+            removed += 1
+        if removed:
+            logger.info(f"Swept {removed} orphaned scratch directories from {self.root}")
+        return removed
@@ -0,0 +1,53 @@
+import logging
+from datetime import datetime, timezone
+from pymongo import ASCENDING, ReturnDocument
+
+from mongo_schema import ensure_ttl_index
+
+logger = logging.getLogger(__name__)
+
+class SearchSessions:
+    """
+    Each sender's latest ranked search results, so `next` can send the following match
+    without embedding the query or searching Qdrant again. Stored in Mongo (one document
+    per sender) because the `next` job may run in a different worker process than the
+    search; sessions expire `ttl` seconds after the search (TTL index on `created_at`).
+    """
+
+    def __init__(self, collection, ttl=30 * 60):
+        self.collection = collection
+        self.ttl = ttl
+
+    def ensure_indexes(self):
+        self.collection.create_index([("sender_id", ASCENDING)], unique=True)
+        ensure_ttl_index(self.collection, "created_at", self.ttl)
+
+    def start(self, sender_id, query, results):
+        """Replace the sender's session with a new ranked list; the first result counts as sent."""
+        self.collection.update_one(
+            {"sender_id": sender_id},
+            {"$set": {"query": query, "results": results, "position": 0, "created_at": datetime.now(timezone.utc)},
+             "$unset": {"last_next_mid": ""}},
+            upsert=True
+        )
+
+    def advance(self, sender_id, mid):
+        """
+        Atomically move to the sender's next result for the `next` message `mid`. Returns
+        (result, position, total) with a 1-based position, (None, total, total) once the list
+        is exhausted, or None without a session. Advancing again with the same `mid` (a retried
+        job) returns the same result instead of skipping one.
+        """
+        session = self.collection.find_one_and_update(
+            {"sender_id": sender_id, "last_next_mid": {"$ne": mid}},
+            {"$inc": {"position": 1}, "$set": {"last_next_mid": mid}},
+            return_document=ReturnDocument.AFTER
+        )
+        if session is None:
+            session = self.collection.find_one({"sender_id": sender_id, "last_next_mid": mid})
+        if session is None:
+            return None
+        results, position = session.get("results", []), session["position"]
+        if position >= len(results):
+            return None, len(results), len(results)
+        return results[position], position + 1, len(results)
@@ -0,0 +1,113 @@
+import os, logging
+from qdrant_client.http.models import (
+    BinaryQuantization, BinaryQuantizationConfig, CollectionParamsDiff, Disabled, HnswConfigDiff,
+    QuantizationSearchParams, ScalarQuantization, ScalarQuantizationConfig, ScalarType, SearchParams,
+    VectorParamsDiff
+)
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATION_MODES = ("none", "scalar", "binary")
+
+def _env_bool(environ, name, default):
+    return environ.get(name, str(default)).lower() == "true"
+
+def _env_int(environ, name):
+    return int(environ[name]) if environ.get(name) else None
+
+class VectorConfig:
+    """
+    Storage and index settings for the dense vector of every collection the app creates, and
+    the matching query-time search parameters.
+    - quantization: "scalar" (int8, ~4x less RAM, small recall loss) or "binary" (1 bit per
+      dimension, ~32x less RAM; recall drops a lot at 384 dims without rescoring), with the
+      quantized vectors kept in RAM (`quantization_always_ram`).
+    - on_disk_vectors / on_disk_payload: keep original vectors and payloads memory-mapped on disk.
+    - hnsw_m / hnsw_ef_construct / hnsw_on_disk: index graph settings; None keeps Qdrant's default.
+    - rescore / oversampling / hnsw_ef: search the quantized index for `oversampling` times the
+      requested points, then re-rank them with the original vectors.
+    """
+
+    def __init__(self, quantization="none", quantization_always_ram=True, on_disk_vectors=False, on_disk_payload=False,
+                 hnsw_m=None, hnsw_ef_construct=None, hnsw_on_disk=None, rescore=True, oversampling=None, hnsw_ef=None):
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization '{quantization}', expected one of {QUANTIZATION_MODES}")
+        self.quantization = quantization
+        self.quantization_always_ram = quantization_always_ram
+        self.on_disk_vectors = on_disk_vectors
+        self.on_disk_payload = on_disk_payload
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construct = hnsw_ef_construct
+        self.hnsw_on_disk = hnsw_on_disk
+        self.rescore = rescore
+        # Binary codes need a wider candidate pool to rescore from
+        self.oversampling = oversampling if oversampling is not None else {"binary": 3.0, "scalar": 1.5}.get(quantization)
+        self.hnsw_ef = hnsw_ef
+
+    @classmethod
+    def from_env(cls, environ=None):
+        environ = os.environ if environ is None else environ
+        return cls(
+            quantization=environ.get("QDRANT_QUANTIZATION", "none").lower(),
+            quantization_always_ram=_env_bool(environ, "QDRANT_QUANTIZATION_ALWAYS_RAM", True),
+            on_disk_vectors=_env_bool(environ, "QDRANT_ON_DISK_VECTORS", False),
+            on_disk_payload=_env_bool(environ, "QDRANT_ON_DISK_PAYLOAD", False),
+            hnsw_m=_env_int(environ, "QDRANT_HNSW_M"),
+            hnsw_ef_construct=_env_int(environ, "QDRANT_HNSW_EF_CONSTRUCT"),
+            hnsw_on_disk=_env_bool(environ, "QDRANT_HNSW_ON_DISK", False) if environ.get("QDRANT_HNSW_ON_DISK") else None,
+            rescore=_env_bool(environ, "QDRANT_RESCORE", True),
+            oversampling=float(environ["QDRANT_OVERSAMPLING"]) if environ.get("QDRANT_OVERSAMPLING") else None,
+            hnsw_ef=_env_int(environ, "QDRANT_HNSW_EF")
+        )
+
+    def quantization_config(self):
+        if self.quantization == "scalar":
+            return ScalarQuantization(scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=self.quantization_always_ram))
+        if self.quantization == "binary":
+            return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=self.quantization_always_ram))
+        return None
+
+    def hnsw_config(self):
+        if self.hnsw_m is None and self.hnsw_ef_construct is None and self.hnsw_on_disk is None:
+            return None
+        return HnswConfigDiff(m=self.hnsw_m, ef_construct=self.hnsw_ef_construct, on_disk=self.hnsw_on_disk)
+
+    def create_kwargs(self):
+        """Extra `create_collection` arguments (the dense VectorParams take `on_disk` separately)."""
+        return {
+            "on_disk_payload": self.on_disk_payload,
+            "hnsw_config": self.hnsw_config(),
+            "quantization_config": self.quantization_config()
+        }
+
+    def update_kwargs(self):
+        """`update_collection` arguments that move an existing collection to this config."""
+        return {
+            "vectors_config": {"": VectorParamsDiff(on_disk=self.on_disk_vectors)},
+            "collection_params": CollectionParamsDiff(on_disk_payload=self.on_disk_payload),
+            "hnsw_config": self.hnsw_config(),
+            # Disabled removes quantization from a collection that had it
+            "quantization_config": self.quantization_config() or Disabled.DISABLED
+        }
+
+    def search_params(self):
+        """Query-time parameters, or None when every setting is Qdrant's default."""
+        quantization = None
+        if self.quantization != "none":
+            quantization = QuantizationSearchParams(ignore=False, rescore=self.rescore, oversampling=self.oversampling)
+        if quantization is None and self.hnsw_ef is None:
+            return None
+        return SearchParams(hnsw_ef=self.hnsw_ef, quantization=quantization)
+
+    def describe(self):
+        return {
+            "quantization": self.quantization,
+            "on_disk_vectors": self.on_disk_vectors,
+            "on_disk_payload": self.on_disk_payload,
+            "hnsw_m": self.hnsw_m,
+            "hnsw_ef_construct": self.hnsw_ef_construct,
+            "hnsw_on_disk": self.hnsw_on_disk,
+            "rescore": self.rescore,
+            "oversampling": self.oversampling,
+            "hnsw_ef": self.hnsw_ef
+        }
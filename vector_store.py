@@ -0,0 +1,327 @@
+import logging, threading, uuid
+from qdrant_client.models import Distance, VectorParams, SparseVectorParams, Modifier
+from qdrant_client.http.models import Filter, FieldCondition, MatchValue, PayloadSchemaType, PointIdsList, KeywordIndexParams, KeywordIndexType, Prefetch, FusionQuery, Fusion
+
+from embeddings import EMBEDDING_DIMENSION
+from hybrid import SPARSE_VECTOR_NAME, bm25_document_vector, bm25_query_vector
+from vector_config import VectorConfig
+
+logger = logging.getLogger(__name__)
+
+# Payload fields looked up by exact value (reply-to context, reel dedup)
+INDEXED_PAYLOAD_FIELDS = ("mid", "reel_id")
+# Shared (multi-tenant) layout: every user's points in one collection, partitioned by this field
+TENANT_FIELD = "sender_id"
+
+# Fixed namespace so the same message always maps to the same point ID
+POINT_ID_NAMESPACE = uuid.UUID("6f1c4e8a-2d3b-5a7e-9c41-0b8d2f6a1e53")
+
+def point_id(source_id):
+    """
+    Deterministic Qdrant point ID (a UUID string) for the message a point's text came from:
+    the webhook `mid` or the Graph API message id, which are the same value. Upserting the
+    same message again overwrites its point instead of adding a duplicate.
+    """
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, str(source_id)))
+
+def payload_source_id(payload):
+    """Message id a payload was built from: `id` for imported messages, `mid` for webhook ones."""
+    return payload.get("id") or payload.get("mid")
+
+def ensure_payload_indexes(qdrant_client, collection_name, shared=False):
+    """
+    Create keyword payload indexes on `mid` and `reel_id` for a collection, plus a tenant
+    index on `sender_id` for the shared collection.
+    Fields that are already indexed are skipped, so this is safe to call repeatedly.
+    Returns the list of fields that were newly indexed.
+    """
+    existing = qdrant_client.get_collection(collection_name).payload_schema or {}
+    created = []
+    if shared and TENANT_FIELD not in existing:
+        qdrant_client.create_payload_index(
+            collection_name=collection_name,
+            field_name=TENANT_FIELD,
+            field_schema=KeywordIndexParams(type=KeywordIndexType.KEYWORD, is_tenant=True)
+        )
+        created.append(TENANT_FIELD)
+        logger.info(f"Created tenant index on '{TENANT_FIELD}' for collection {collection_name}")
+    for field_name in INDEXED_PAYLOAD_FIELDS:
+        if field_name in existing:
+            continue
+        qdrant_client.create_payload_index(
+            collection_name=collection_name,
+            field_name=field_name,
+            field_schema=PayloadSchemaType.KEYWORD
+        )
+        created.append(field_name)
+        logger.info(f"Created payload index on '{field_name}' for collection {collection_name}")
+    return created
+
+def create_collection(qdrant_client, collection_name, shared=False, hybrid=False, config=None):
+    """
+    Create a MiniLM (384-dim, cosine) collection with its payload indexes. With `hybrid`
+    it also gets a sparse BM25 vector (IDF computed by Qdrant) for keyword matching.
+    Quantization, on-disk storage and HNSW settings come from `config` (default: environment).
+    """
+    config = config or VectorConfig.from_env()
+    qdrant_client.create_collection(
+        collection_name=collection_name,
+        vectors_config=VectorParams(size=EMBEDDING_DIMENSION, distance=Distance.COSINE, on_disk=config.on_disk_vectors),
+        sparse_vectors_config={SPARSE_VECTOR_NAME: SparseVectorParams(modifier=Modifier.IDF)} if hybrid else None,
+        **config.create_kwargs()
+    )
+    logger.info(f"Created new collection: {collection_name}{' (hybrid)' if hybrid else ''}")
+    ensure_payload_indexes(qdrant_client, collection_name, shared=shared)
+
+def has_sparse_vector(collection_info):
+    return SPARSE_VECTOR_NAME in (collection_info.config.params.sparse_vectors or {})
+
+class CollectionCache:
+    """
+    In-process record of collections known to exist, so writes skip the existence check
+    after the first one. Missing collections are created with `create_collection` (hybrid
+    when `hybrid` is set). Remembers whether each collection has the sparse BM25 vector,
+    since collections created before hybrid search was enabled don't.
+    Call `forget` when a write fails, in case the collection was deleted behind our back.
+    """
+
+    def __init__(self, shared_collection=None, hybrid=False, config=None):
+        self.shared_collection = shared_collection
+        self.hybrid = hybrid
+        self.config = config
+        self._known = {}
+        self._lock = threading.Lock()
+
+    def ensure(self, qdrant_client, collection_name):
+        """Make sure the collection exists. Returns True if it has the sparse vector."""
+        if collection_name in self._known:
+            return self._known[collection_name]
+        with self._lock:
+            if collection_name in self._known:
+                return self._known[collection_name]
+            if not qdrant_client.collection_exists(collection_name):
+                try:
+                    create_collection(qdrant_client, collection_name, shared=collection_name == self.shared_collection, hybrid=self.hybrid, config=self.config)
+                except Exception:
+                    # Another process may have created it first
+                    if not qdrant_client.collection_exists(collection_name):
+                        raise
+            self._known[collection_name] = has_sparse_vector(qdrant_client.get_collection(collection_name)) if self.hybrid else False
+            return self._known[collection_name]
+
+    def has_sparse(self, qdrant_client, collection_name):
+        """Whether an existing collection has the sparse vector, without creating it if missing."""
+        if collection_name in self._known:
+            return self._known[collection_name]
+        if not self.hybrid or not qdrant_client.collection_exists(collection_name):
+            return False
+        self._known[collection_name] = has_sparse_vector(qdrant_client.get_collection(collection_name))
+        return self._known[collection_name]
+
+    def forget(self, collection_name):
+        self._known.pop(collection_name, None)
+
+    def __len__(self):
+        return len(self._known)
+
+def tenant_filter(sender_id, *conditions):
+    """Filter matching `conditions` within one user's points of the shared collection."""
+    return Filter(must=[FieldCondition(key=TENANT_FIELD, match=MatchValue(value=sender_id)), *conditions])
+
+def search_points(qdrant_client, collection_name, embedding, keyword_text=None, limit=1, candidates=20, query_filter=None, search_params=None):
+    """
+    Nearest points to a dense query embedding. With `keyword_text` (hybrid collections only),
+    the top `candidates` by dense and by BM25 keyword score are fused with reciprocal rank fusion.
+    `search_params` (VectorConfig.search_params) applies to the dense search, e.g. rescoring
+    quantized vectors with the originals.
+    """
+    sparse_query = bm25_query_vector(keyword_text) if keyword_text else None
+    if sparse_query and sparse_query.indices:
+        return qdrant_client.query_points(
+            collection_name=collection_name,
+            prefetch=[
+                Prefetch(query=embedding, filter=query_filter, params=search_params, limit=candidates),
+                Prefetch(query=sparse_query, using=SPARSE_VECTOR_NAME, filter=query_filter, limit=candidates)
+            ],
+            query=FusionQuery(fusion=Fusion.RRF),
+            limit=limit
+        ).points
+    return qdrant_client.query_points(
+        collection_name=collection_name,
+        query=embedding,
+        query_filter=query_filter,
+        search_params=search_params,
+        limit=limit
+    ).points
+
+def apply_vector_config(qdrant_client, collection_name, config):
+    """
+    Move an existing collection to `config` in place: quantization (built in the background
+    by Qdrant), on-disk vectors/payload and HNSW settings. Returns the collection's status.
+    """
+    qdrant_client.update_collection(collection_name=collection_name, **config.update_kwargs())
+    status = qdrant_client.get_collection(collection_name).status
+    logger.info(f"Applied vector config to {collection_name} (status {status})")
+    return status
+
+def find_point_by_mid(qdrant_client, collection_name, target_mid, sender_id=None):
+    """
+    Find a single point in a collection by its `mid` payload using the keyword index.
+    Pass `sender_id` to restrict the lookup to one tenant of the shared collection.
+    """
+    condition = FieldCondition(key="mid", match=MatchValue(value=target_mid))
+    try:
+        points, _ = qdrant_client.scroll(
+            collection_name=collection_name,
+            scroll_filter=tenant_filter(sender_id, condition) if sender_id else Filter(must=[condition]),
+            limit=1,
+            with_payload=True,
+            with_vectors=False
+        )
+    except Exception as e:
+        logger.exception(f"Error finding point by MID: {e}")
+        return None
+
+    if not points:
+        logger.warning(f"No point found with MID: {target_mid[:50]}... in collection {collection_name}")
+        return None
+    logger.info(f"Found matching point for MID: {target_mid[:50]}...")
+    return points[0]
+
+def _newest_first(point):
+    payload = point.payload or {}
+    return -(payload.get("created_time") or payload.get("timestamp") or 0)
+
+def compact_collection(qdrant_client, collection_name, dry_run=False, batch_size=256):
+    """
+    Merge duplicate points left by random IDs (webhook retries, repeated imports).
+    Points with the same source message and text are duplicates: the newest is kept, gaps in
+    its payload are filled from the others and the rest are deleted. Imported points are also
+    moved to their deterministic ID so later re-imports overwrite them. Descriptions stored from
+    webhooks keep their ID, since their payload `mid` is the reel's, not the description's.
+    Returns (points scanned, points removed).
+    """
+    groups = {}
+    scanned = 0
+    offset = None
+    while True:
+        points, offset = qdrant_client.scroll(
+            collection_name=collection_name,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=False
+        )
+        for point in points:
+            payload = point.payload or {}
+            groups.setdefault((payload_source_id(payload), payload.get("message")), []).append(point)
+        scanned += len(points)
+        if offset is None:
+            break
+
+    removed = 0
+    for (source_id, _), points in groups.items():
+        if source_id is None:
+            continue
+        keep = sorted(points, key=_newest_first)[0]
+        target_id = point_id(source_id) if (keep.payload or {}).get("id") else str(keep.id)
+        if len(points) == 1 and target_id == str(keep.id):
+            continue
+
+        merged = dict(keep.payload or {})
+        for point in points:
+            for key, value in (point.payload or {}).items():
+                if merged.get(key) is None:
+                    merged[key] = value
+        stale = [point.id for point in points if str(point.id) != target_id]
+        removed += len(points) - 1
+        if dry_run:
+            continue
+
+        if target_id != str(keep.id):
+            vector = qdrant_client.retrieve(collection_name, ids=[keep.id], with_vectors=True)[0].vector
+            qdrant_client.upsert(collection_name=collection_name, points=[{"id": target_id, "vector": vector, "payload": merged}])
+        elif merged != keep.payload:
+            qdrant_client.set_payload(collection_name=collection_name, payload=merged, points=[keep.id])
+        if stale:
+            qdrant_client.delete(collection_name=collection_name, points_selector=PointIdsList(points=stale))
+
+    logger.info(f"{'Would remove' if dry_run else 'Removed'} {removed} duplicate points from {collection_name} ({scanned} scanned)")
+    return scanned, removed
+
+def point_vectors(vector, sparse_text=None):
+    """
+    Vectors to upsert for a point read with `with_vectors=True`: the dense MiniLM vector,
+    plus a BM25 sparse vector built from `sparse_text` when the target is hybrid.
+    """
+    dense = vector.get("") if isinstance(vector, dict) else vector
+    if sparse_text is None:
+        return dense
+    return {"": dense, SPARSE_VECTOR_NAME: bm25_document_vector(sparse_text)}
+
+def copy_points(qdrant_client, source_collection, target_collection, convert, batch_size=256):
+    """Scroll every point of `source_collection` and upsert `convert(point)` into `target_collection`. Returns points copied."""
+    copied = 0
+    offset = None
+    while True:
+        points, offset = qdrant_client.scroll(
+            collection_name=source_collection,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True
+        )
+        if points:
+            qdrant_client.upsert(collection_name=target_collection, points=[convert(point) for point in points])
+            copied += len(points)
+        if offset is None:
+            break
+    logger.info(f"Copied {copied} points from {source_collection} to {target_collection}")
+    return copied
+
+def migrate_to_shared(qdrant_client, source_collection, target_collection, batch_size=256):
+    """
+    Copy every point of a per-user collection into the shared collection, tagging payloads
+    with the collection name as `sender_id`. Deterministic (UUID) point IDs are kept; legacy
+    integer IDs, which are only unique within one collection, get a UUID derived from the
+    collection and the old ID. Re-running overwrites the same points. Returns points copied.
+    """
+    hybrid = has_sparse_vector(qdrant_client.get_collection(target_collection))
+    return copy_points(qdrant_client, source_collection, target_collection, lambda point: {
+        "id": str(point.id) if isinstance(point.id, str) else point_id(f"{source_collection}:{point.id}"),
+        "vector": point_vectors(point.vector, ((point.payload or {}).get("message") or "") if hybrid else None),
+        "payload": {**(point.payload or {}), TENANT_FIELD: source_collection}
+    }, batch_size=batch_size)
+
+def rebuild_as_hybrid(qdrant_client, collection_name, shared=False, batch_size=256):
+    """
+    Recreate a dense-only collection with the sparse BM25 vector, computed from each point's
+    `message`. Points are staged in `<name>__hybrid`, the original is recreated and filled back,
+    and the staging collection is dropped; a run interrupted after staging resumes from it.
+    Writes to the collection during the rebuild may be lost, so stop the workers first.
+    Returns points copied, or 0 if the collection already had the sparse vector.
+    """
+    staging = f"{collection_name}__hybrid"
+    staged = qdrant_client.collection_exists(staging)
+    if qdrant_client.collection_exists(collection_name):
+        if has_sparse_vector(qdrant_client.get_collection(collection_name)):
+            if not staged:
+                return 0
+            # Interrupted while filling the rebuilt collection: finish copying back
+        else:
+            if not staged:
+                create_collection(qdrant_client, staging, shared=shared, hybrid=True)
+            copy_points(qdrant_client, collection_name, staging, lambda point: {
+                "id": point.id,
+                "vector": point_vectors(point.vector, (point.payload or {}).get("message") or ""),
+                "payload": point.payload
+            }, batch_size=batch_size)
+            qdrant_client.delete_collection(collection_name)
+
+    if not qdrant_client.collection_exists(collection_name):
+        create_collection(qdrant_client, collection_name, shared=shared, hybrid=True)
+    copied = copy_points(qdrant_client, staging, collection_name, lambda point: {
+        "id": point.id, "vector": point.vector, "payload": point.payload
+    }, batch_size=batch_size)
+    qdrant_client.delete_collection(staging)
+    return copied
@@ -0,0 +1,15 @@
+"""
+Lightweight web entry point: serves the webhook and API routes and enqueues jobs,
+but never loads the embedding model or runs background jobs (see worker.py).
+
+Usage:
+    waitress-serve --port=5000 web:app
+"""
+import os
+
+os.environ["APP_ROLE"] = "web"
+
+from app import app  # noqa: E402
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=int(os.getenv("PORT", 8080)))
@@ -0,0 +1,25 @@
+"""
+Background worker entry point: runs attachment, search, description, reply and import jobs
+from the shared Mongo job queue without serving HTTP.
+
+Usage:
+    python -m worker
+Run as many worker containers as needed next to the web tier (see web.py).
+"""
+import os, signal, threading
+
+def main():
+    # Imported here, not at module level, so spawned embedding processes that
+    # re-import this module as __mp_main__ don't start job workers of their own
+    os.environ["APP_ROLE"] = "worker"
+    import app  # Starts the job workers and model warm-up for this role
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    app.logger.info("Worker started, waiting for jobs")
+    stop.wait()
+    app.logger.info("Worker stopping; leased jobs are picked up again after their visibility timeout")
+
+if __name__ == '__main__':
+    main()